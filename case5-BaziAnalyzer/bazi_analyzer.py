@@ -1,145 +1,262 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
+import bisect
+import collections
+import contextlib
+import cProfile
+import csv
 import datetime
+import hashlib
 import json
-from typing import List, Dict, Tuple
+import math
+import mmap
+import multiprocessing
+import operator
+import os
+import pstats
+import sqlite3
+import struct
+import sys
+import time
+from types import MappingProxyType
+from typing import Any, IO, Iterable, Iterator, List, Dict, Mapping, Tuple
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
 
 # ============= Module: models =============
 from typing import Dict, List, Tuple
 
+# 干支、五行的固定顺序，整数编码即为在此列表中的下标（缺失的柱位编码为 -1）
+TIAN_GAN_ORDER = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
+DI_ZHI_ORDER = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
+WUXING_ORDER = ['木', '火', '土', '金', '水']
+PILLAR_ORDER = ['year', 'month', 'day', 'hour']
+
+def freeze(value: Any) -> Any:
+    """递归地把 dict / list 转为只读的 MappingProxyType / tuple。"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
 class GanZhi:
     """
     干支数据结构：基于《三命通会》对天干和地支的描述，
     增加详细属性，如天干的五行、阴阳、序号以及地支的藏干、三合、冲、合、刑、害等关系。
+    两张表为类属性，所有实例共享，以 freeze 冻结为只读映射（修改会抛出 TypeError），计算模块统一读取由其编译得到的 GANZHI_TABLES。
+    需要不同数据时在实例上整体替换 gan / zhi，GanZhiTables.of 会为其另行编译。
     """
-    def __init__(self):
-        # 天干属性：增加了“序号”，后续可扩展其他属性（如生克、制化等）
-        self.gan: Dict[str, Dict[str, str]] = {
-            '甲': {'wx': '木', 'yy': '阳', 'order': '1'},
-            '乙': {'wx': '木', 'yy': '阴', 'order': '2'},
-            '丙': {'wx': '火', 'yy': '阳', 'order': '3'},
-            '丁': {'wx': '火', 'yy': '阴', 'order': '4'},
-            '戊': {'wx': '土', 'yy': '阳', 'order': '5'},
-            '己': {'wx': '土', 'yy': '阴', 'order': '6'},
-            '庚': {'wx': '金', 'yy': '阳', 'order': '7'},
-            '辛': {'wx': '金', 'yy': '阴', 'order': '8'},
-            '壬': {'wx': '水', 'yy': '阳', 'order': '9'},
-            '癸': {'wx': '水', 'yy': '阴', 'order': '10'}
-        }
-        # 地支属性：扩展《三命通会》中对地支的描述，包含藏干、三友、宫位，并新增“冲”、“合”、“刑”、“害”等关系
-        self.zhi: Dict[str, Dict] = {
-            '子': {
-                'canggan': [('癸', 1.0)],
-                'sanyou': '鼠',
-                'gongwei': '坎宫',
-                'chong': ['午'],      # 子午冲
-                'he': ['亥', '丑'],    # 示例：子与亥、丑合局（后续可进一步细化）
-                'xing': ['卯'],       # 示例刑（具体刑局在《三命通会》中有详细记载）
-                'hai': []             # 无害
-            },
-            '丑': {
-                'canggan': [('己', 0.6), ('癸', 0.3), ('辛', 0.1)],
-                'sanyou': '牛',
-                'gongwei': '艮宫',
-                'chong': ['未'],
-                'he': ['戌', '子'],    # 示例数据
-                'xing': [],
-                'hai': ['未']         # 丑害未（示例）
-            },
-            '寅': {
-                'canggan': [('甲', 0.6), ('丙', 0.3), ('戊', 0.1)],
-                'sanyou': '虎',
-                'gongwei': '震宫',
-                'chong': ['申'],
-                'he': ['巳'],         # 寅与巳合火局（示例）
-                'xing': ['巳'],       # 寅刑巳（示例）
-                'hai': []
-            },
-            '卯': {
-                'canggan': [('乙', 1.0)],
-                'sanyou': '兔',
-                'gongwei': '巽宫',
-                'chong': ['酉'],
-                'he': ['未'],         # 示例数据
-                'xing': ['酉'],       # 示例数据
-                'hai': []
-            },
-            '辰': {
-                'canggan': [('戊', 0.7), ('乙', 0.2), ('癸', 0.1)],
-                'sanyou': '龙',
-                'gongwei': '中宫',
-                'chong': ['戌'],
-                'he': ['酉'],         # 示例数据
-                'xing': [],
-                'hai': []
-            },
-            '巳': {
-                'canggan': [('丙', 0.7), ('戊', 0.2), ('庚', 0.1)],
-                'sanyou': '蛇',
-                'gongwei': '离宫',
-                'chong': ['亥'],
-                'he': ['寅'],         # 示例数据
-                'xing': ['寅'],       # 示例数据
-                'hai': []
-            },
-            '午': {
-                'canggan': [('丁', 0.7), ('己', 0.3)],
-                'sanyou': '马',
-                'gongwei': '离宫',
-                'chong': ['子'],
-                'he': ['申'],         # 示例数据
-                'xing': [],
-                'hai': []
-            },
-            '未': {
-                'canggan': [('己', 0.6), ('丁', 0.3), ('乙', 0.1)],
-                'sanyou': '羊',
-                'gongwei': '坤宫',
-                'chong': ['丑'],
-                'he': ['卯'],         # 示例数据
-                'xing': [],
-                'hai': ['丑']         # 示例数据
-            },
-            '申': {
-                'canggan': [('庚', 0.7), ('壬', 0.2), ('戊', 0.1)],
-                'sanyou': '猴',
-                'gongwei': '兑宫',
-                'chong': ['寅'],
-                'he': ['午'],         # 示例数据
-                'xing': [],
-                'hai': []
-            },
-            '酉': {
-                'canggan': [('辛', 1.0)],
-                'sanyou': '鸡',
-                'gongwei': '兑宫',
-                'chong': ['卯'],
-                'he': ['辰'],         # 示例数据
-                'xing': [],
-                'hai': []
-            },
-            '戌': {
-                'canggan': [('戊', 0.7), ('辛', 0.2), ('丁', 0.1)],
-                'sanyou': '狗',
-                'gongwei': '艮宫',
-                'chong': ['辰'],
-                'he': ['丑'],         # 示例数据
-                'xing': [],
-                'hai': []
-            },
-            '亥': {
-                'canggan': [('壬', 0.7), ('甲', 0.3)],
-                'sanyou': '猪',
-                'gongwei': '坎宫',
-                'chong': ['巳'],
-                'he': ['子'],         # 示例数据
-                'xing': [],
-                'hai': []
-            }
+    # 天干属性：增加了“序号”，后续可扩展其他属性（如生克、制化等）
+    gan: Mapping[str, Mapping[str, str]] = freeze({
+        '甲': {'wx': '木', 'yy': '阳', 'order': '1'},
+        '乙': {'wx': '木', 'yy': '阴', 'order': '2'},
+        '丙': {'wx': '火', 'yy': '阳', 'order': '3'},
+        '丁': {'wx': '火', 'yy': '阴', 'order': '4'},
+        '戊': {'wx': '土', 'yy': '阳', 'order': '5'},
+        '己': {'wx': '土', 'yy': '阴', 'order': '6'},
+        '庚': {'wx': '金', 'yy': '阳', 'order': '7'},
+        '辛': {'wx': '金', 'yy': '阴', 'order': '8'},
+        '壬': {'wx': '水', 'yy': '阳', 'order': '9'},
+        '癸': {'wx': '水', 'yy': '阴', 'order': '10'}
+    })
+    # 地支属性：扩展《三命通会》中对地支的描述，包含藏干、三友、宫位，并新增“冲”、“合”、“刑”、“害”等关系
+    zhi: Mapping[str, Mapping] = freeze({
+        '子': {
+            'canggan': [('癸', 1.0)],
+            'sanyou': '鼠',
+            'gongwei': '坎宫',
+            'chong': ['午'],      # 子午冲
+            'he': ['亥', '丑'],    # 示例：子与亥、丑合局（后续可进一步细化）
+            'xing': ['卯'],       # 示例刑（具体刑局在《三命通会》中有详细记载）
+            'hai': []             # 无害
+        },
+        '丑': {
+            'canggan': [('己', 0.6), ('癸', 0.3), ('辛', 0.1)],
+            'sanyou': '牛',
+            'gongwei': '艮宫',
+            'chong': ['未'],
+            'he': ['戌', '子'],    # 示例数据
+            'xing': [],
+            'hai': ['未']         # 丑害未（示例）
+        },
+        '寅': {
+            'canggan': [('甲', 0.6), ('丙', 0.3), ('戊', 0.1)],
+            'sanyou': '虎',
+            'gongwei': '震宫',
+            'chong': ['申'],
+            'he': ['巳'],         # 寅与巳合火局（示例）
+            'xing': ['巳'],       # 寅刑巳（示例）
+            'hai': []
+        },
+        '卯': {
+            'canggan': [('乙', 1.0)],
+            'sanyou': '兔',
+            'gongwei': '巽宫',
+            'chong': ['酉'],
+            'he': ['未'],         # 示例数据
+            'xing': ['酉'],       # 示例数据
+            'hai': []
+        },
+        '辰': {
+            'canggan': [('戊', 0.7), ('乙', 0.2), ('癸', 0.1)],
+            'sanyou': '龙',
+            'gongwei': '中宫',
+            'chong': ['戌'],
+            'he': ['酉'],         # 示例数据
+            'xing': [],
+            'hai': []
+        },
+        '巳': {
+            'canggan': [('丙', 0.7), ('戊', 0.2), ('庚', 0.1)],
+            'sanyou': '蛇',
+            'gongwei': '离宫',
+            'chong': ['亥'],
+            'he': ['寅'],         # 示例数据
+            'xing': ['寅'],       # 示例数据
+            'hai': []
+        },
+        '午': {
+            'canggan': [('丁', 0.7), ('己', 0.3)],
+            'sanyou': '马',
+            'gongwei': '离宫',
+            'chong': ['子'],
+            'he': ['申'],         # 示例数据
+            'xing': [],
+            'hai': []
+        },
+        '未': {
+            'canggan': [('己', 0.6), ('丁', 0.3), ('乙', 0.1)],
+            'sanyou': '羊',
+            'gongwei': '坤宫',
+            'chong': ['丑'],
+            'he': ['卯'],         # 示例数据
+            'xing': [],
+            'hai': ['丑']         # 示例数据
+        },
+        '申': {
+            'canggan': [('庚', 0.7), ('壬', 0.2), ('戊', 0.1)],
+            'sanyou': '猴',
+            'gongwei': '兑宫',
+            'chong': ['寅'],
+            'he': ['午'],         # 示例数据
+            'xing': [],
+            'hai': []
+        },
+        '酉': {
+            'canggan': [('辛', 1.0)],
+            'sanyou': '鸡',
+            'gongwei': '兑宫',
+            'chong': ['卯'],
+            'he': ['辰'],         # 示例数据
+            'xing': [],
+            'hai': []
+        },
+        '戌': {
+            'canggan': [('戊', 0.7), ('辛', 0.2), ('丁', 0.1)],
+            'sanyou': '狗',
+            'gongwei': '艮宫',
+            'chong': ['辰'],
+            'he': ['丑'],         # 示例数据
+            'xing': [],
+            'hai': []
+        },
+        '亥': {
+            'canggan': [('壬', 0.7), ('甲', 0.3)],
+            'sanyou': '猪',
+            'gongwei': '坎宫',
+            'chong': ['巳'],
+            'he': ['子'],         # 示例数据
+            'xing': [],
+            'hai': []
         }
+    })
+
+class GanZhiTables:
+    """
+    整数编码的干支只读表：由 GanZhi 编译一次，供各计算模块共享。
+      - 天干编码 0-9、地支编码 0-11、五行编码 0-4（顺序见 TIAN_GAN_ORDER / DI_ZHI_ORDER / WUXING_ORDER）
+      - 标量查表使用元组，批量计算使用只读 NumPy 矩阵（末行对应缺失编码 -1，恒为零或 -1）
+      - 冲、合、刑、害以 12 位地支位掩码表示：relations['chong'][z] 的第 k 位为 1 表示与地支 k 相冲
+    """
+    RELATIONS = ('chong', 'he', 'xing', 'hai')
+
+    def __init__(self, ganzhi: GanZhi):
+        gan_index = {gan: code for code, gan in enumerate(TIAN_GAN_ORDER)}
+        zhi_index = {zhi: code for code, zhi in enumerate(DI_ZHI_ORDER)}
+        wx_index = {wx: code for code, wx in enumerate(WUXING_ORDER)}
+        self.gan_index: Mapping[str, int] = MappingProxyType(gan_index)
+        self.zhi_index: Mapping[str, int] = MappingProxyType(zhi_index)
+        # 天干：五行编码、阴阳（True 为阳）、序号
+        self.gan_wx: Tuple[int, ...] = tuple(wx_index[ganzhi.gan[g]['wx']] for g in TIAN_GAN_ORDER)
+        self.gan_yang: Tuple[bool, ...] = tuple(ganzhi.gan[g]['yy'] == '阳' for g in TIAN_GAN_ORDER)
+        self.gan_order: Tuple[int, ...] = tuple(int(ganzhi.gan[g]['order']) for g in TIAN_GAN_ORDER)
+        # 地支藏干：((天干编码, 权重), ...)，以及按五行展开的 ((五行编码, 0.5 * 权重), ...)，保持原有顺序
+        self.zhi_canggan: Tuple[Tuple[Tuple[int, float], ...], ...] = tuple(
+            tuple((gan_index[g], w) for g, w in ganzhi.zhi[z]['canggan']) for z in DI_ZHI_ORDER
+        )
+        self.zhi_hidden_wx: Tuple[Tuple[Tuple[int, float], ...], ...] = tuple(
+            tuple((self.gan_wx[g], 0.5 * w) for g, w in canggan) for canggan in self.zhi_canggan
+        )
+        # 地支关系位掩码
+        relations: Dict[str, Tuple[int, ...]] = {}
+        for name in self.RELATIONS:
+            masks = []
+            for z in DI_ZHI_ORDER:
+                mask = 0
+                for other in ganzhi.zhi[z].get(name, []):
+                    mask |= 1 << zhi_index[other]
+                masks.append(mask)
+            relations[name] = tuple(masks)
+        self.relations: Mapping[str, Tuple[int, ...]] = MappingProxyType(relations)
+        # 批量计算矩阵
+        gan_wx_arr = np.full(len(TIAN_GAN_ORDER) + 1, -1, dtype=np.int64)
+        gan_wx_arr[:-1] = self.gan_wx
+        canggan_weight = np.zeros((len(DI_ZHI_ORDER) + 1, len(TIAN_GAN_ORDER)), dtype=np.float64)
+        zhi_hidden = np.zeros((len(DI_ZHI_ORDER) + 1, len(WUXING_ORDER)), dtype=np.float64)
+        for z, canggan in enumerate(self.zhi_canggan):
+            for g, w in canggan:
+                canggan_weight[z, g] += w
+                zhi_hidden[z, self.gan_wx[g]] += 0.5 * w
+        relation_matrix = {}
+        for name, masks in self.relations.items():
+            relation_matrix[name] = np.array(
+                [[(m >> k) & 1 for k in range(len(DI_ZHI_ORDER))] for m in masks], dtype=bool
+            )
+        for arr in [gan_wx_arr, canggan_weight, zhi_hidden, *relation_matrix.values()]:
+            arr.flags.writeable = False
+        self.gan_wx_array: np.ndarray = gan_wx_arr            # (11,) 天干 -> 五行
+        self.canggan_weight: np.ndarray = canggan_weight      # (13, 10) 地支 -> 藏干权重
+        self.zhi_hidden: np.ndarray = zhi_hidden              # (13, 5) 地支 -> 藏干五行得分
+        self.relation_matrix: Mapping[str, np.ndarray] = MappingProxyType(relation_matrix)  # 各 (12, 12) 布尔矩阵
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("GanZhiTables is read-only")
+        super().__setattr__(name, value)
+
+    @staticmethod
+    def of(ganzhi: GanZhi = None) -> 'GanZhiTables':
+        """
+        返回与 ganzhi 对应的编码表：未传入或使用默认（共享）数据时直接返回全局单例 GANZHI_TABLES。
+        """
+        if ganzhi is None or (ganzhi.gan is GanZhi.gan and ganzhi.zhi is GanZhi.zhi):
+            return GANZHI_TABLES
+        return GanZhiTables(ganzhi)
+
+    def encode_gan(self, gan: str) -> int:
+        return self.gan_index.get(gan, -1)
+
+    def encode_zhi(self, zhi: str) -> int:
+        return self.zhi_index.get(zhi, -1)
+
+    def has_relation(self, name: str, zhi_a: int, zhi_b: int) -> bool:
+        return bool((self.relations[name][zhi_a] >> zhi_b) & 1)
+
+# 导入时编译一次，全局共享
+GANZHI_TABLES = GanZhiTables(GanZhi())
 
 class MingPan:
     """
@@ -175,15 +292,207 @@ class MingPan:
         # 神煞列表，用于记录命盘中的吉凶标记
         self.shenshen: List[str] = []
 
+    def encode_pillars(self) -> Tuple[List[int], List[int]]:
+        """
+        将四柱编码为整数：天干 0-9、地支 0-11，按年、月、日、时排列，缺失或非法的干支记为 -1。
+        """
+        gan_codes = []
+        zhi_codes = []
+        for pillar in PILLAR_ORDER:
+            value = self.pillars.get(pillar, {})
+            gan_codes.append(GANZHI_TABLES.encode_gan(value.get('gan', '')))
+            zhi_codes.append(GANZHI_TABLES.encode_zhi(value.get('zhi', '')))
+        return gan_codes, zhi_codes
+
+    # 特征向量各列含义：四柱天干 one-hot（4 x 10）、四柱地支 one-hot（4 x 12）、五行得分（5）
+    FEATURE_NAMES: List[str] = (
+        [f"{p}_gan_{g}" for p in PILLAR_ORDER for g in TIAN_GAN_ORDER]
+        + [f"{p}_zhi_{z}" for p in PILLAR_ORDER for z in DI_ZHI_ORDER]
+        + [f"wuxing_{wx}" for wx in WUXING_ORDER]
+    )
+
+    @staticmethod
+    def feature_matrix(gan_codes: np.ndarray, zhi_codes: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """
+        批量特征编码：输入 (N, 4) 干支编码与 (N, 5) 五行得分，返回 (N, len(FEATURE_NAMES)) 的 float64 矩阵。
+        缺失的干支（-1）对应的 one-hot 段全为 0。
+        """
+        gan_codes = np.asarray(gan_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        zhi_codes = np.asarray(zhi_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        n = gan_codes.shape[0]
+        n_gan, n_zhi = len(TIAN_GAN_ORDER), len(DI_ZHI_ORDER)
+        zhi_start = len(PILLAR_ORDER) * n_gan
+        wx_start = zhi_start + len(PILLAR_ORDER) * n_zhi
+        features = np.zeros((n, len(MingPan.FEATURE_NAMES)), dtype=np.float64)
+        rows = np.arange(n)
+        for p in range(len(PILLAR_ORDER)):
+            present = gan_codes[:, p] >= 0
+            features[rows[present], p * n_gan + gan_codes[present, p]] = 1.0
+            present = zhi_codes[:, p] >= 0
+            features[rows[present], zhi_start + p * n_zhi + zhi_codes[present, p]] = 1.0
+        features[:, wx_start:] = np.asarray(scores, dtype=np.float64).reshape(n, len(WUXING_ORDER))
+        return features
+
+    def to_vector(self) -> np.ndarray:
+        """命盘的定长数值特征（见 FEATURE_NAMES），五行得分取当前 wuxing 中的值。"""
+        gan_codes, zhi_codes = self.encode_pillars()
+        scores = [self.wuxing[wx]['score'] for wx in WUXING_ORDER]
+        return MingPan.feature_matrix([gan_codes], [zhi_codes], [scores])[0]
+
 # ============= Module: calendar_conversion =============
+class SolarTermTable:
+    """
+    节气表：预先计算 first_year..last_year 每年 12 个“节”（小寒、立春、惊蛰……大雪）的交节时刻，
+    以紧凑二进制文件保存，运行时内存映射后用二分查找定位月令，不再做任何天文计算。
+    交节时刻在建表时以 PyEphem 求太阳地心视黄经（VSOP87 行星理论，含章动与光行差，ΔT 取其内置的观测表），
+    与香港天文台公布的时刻相差在一分钟以内；建表需要 ephem（pip install ephem），运行时不需要。
+
+    文件格式（小端）：
+      - 头部 8 字节：魔数 b'SOL2'、起始年份 uint16、年数 uint16
+      - 正文：年数 * 12 + 2 个 int32，为交节时刻距 起始年份-01-01 00:00（东八区）的分钟数，严格递增；
+        首尾各多存一个节（前一年的大雪、次年的小寒），使 起始年份-01-01 至 结束年份-12-31 全部可查
+    """
+    MAGIC = b'SOL2'
+    HEADER = struct.Struct('<4sHH')
+    DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'solar_terms.bin')
+    # 每年 12 个节对应的太阳视黄经（度），依公历先后：小寒、立春、惊蛰、清明、立夏、芒种、小暑、立秋、白露、寒露、立冬、大雪
+    JIE_LONGITUDES = (285, 315, 345, 15, 45, 75, 105, 135, 165, 195, 225, 255)
+    # 迭代求解时的初值（公历月、日）
+    JIE_APPROX_DATES = ((1, 6), (2, 4), (3, 6), (4, 5), (5, 6), (6, 6),
+                        (7, 7), (8, 8), (9, 8), (10, 8), (11, 7), (12, 7))
+    _instance = None
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, first_year, year_count = self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a solar term table (rebuild it with SolarTermTable.build)")
+        self.first_year: int = first_year
+        self.last_year: int = first_year + year_count - 1
+        self.epoch = datetime.datetime(first_year, 1, 1)
+        # 表中下标 0 为前一年的大雪；节序号 = 年份 * 12 + 年内序号（0 为小寒）
+        self.jie_base: int = (first_year - 1) * 12 + len(self.JIE_LONGITUDES) - 1
+        # 标量查询：memoryview 直接支持 bisect；批量查询：零拷贝的 NumPy 视图
+        self.minutes = memoryview(self._mmap)[self.HEADER.size:].cast('i')
+        self.minutes_array: np.ndarray = np.frombuffer(self._mmap, dtype='<i4', offset=self.HEADER.size)
+
+    @classmethod
+    def load(cls) -> 'SolarTermTable':
+        """返回进程内共享的节气表（首次调用时映射默认文件）。"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def locate(self, birth_time: datetime.datetime) -> Tuple[int, int]:
+        """
+        返回 (节序号, 距 epoch 的分钟数)：节序号为不晚于 birth_time 的最近一个节的 年份 * 12 + 年内序号。
+        """
+        minutes = (birth_time - self.epoch) // datetime.timedelta(minutes=1)
+        k = bisect.bisect_right(self.minutes, minutes) - 1
+        if k < 0 or k >= len(self.minutes) - 1:
+            raise ValueError(f"{birth_time} is outside the solar term table ({self.first_year}-{self.last_year})")
+        return k + self.jie_base, minutes
+
+    # ---- 以下为建表所需的天文计算，仅在 build 时使用 ----
+    @staticmethod
+    def apparent_solar_longitude(date) -> float:
+        """太阳地心视黄经（度），date 为 ephem.Date（UT）。"""
+        import ephem
+        sun = ephem.Sun()
+        sun.compute(date, epoch=date)
+        apparent = ephem.Equatorial(sun.g_ra, sun.g_dec, epoch=date)
+        return math.degrees(ephem.Ecliptic(apparent, epoch=date).lon)
+
+    @classmethod
+    def solve_jie(cls, year: int, index: int) -> datetime.datetime:
+        """求 year 年第 index 个节的交节时刻（东八区，四舍五入到分钟）。"""
+        import ephem
+        month, day = cls.JIE_APPROX_DATES[index]
+        target = cls.JIE_LONGITUDES[index]
+        date = ephem.Date(datetime.datetime(year, month, day) - datetime.timedelta(hours=8))
+        for _ in range(20):
+            diff = (target - cls.apparent_solar_longitude(date) + 180.0) % 360.0 - 180.0
+            date = ephem.Date(date + diff / 360.0 * 365.2422)
+            if abs(diff) < 1e-7:
+                break
+        # ephem.Date 为自 1899-12-31 12:00 起的日数
+        minutes = round((float(date) + 8 / 24.0) * 1440)
+        return datetime.datetime(1899, 12, 31, 12) + datetime.timedelta(minutes=minutes)
+
+    @classmethod
+    def build(cls, path: str = DEFAULT_PATH, first_year: int = 1600, last_year: int = 2200) -> None:
+        """生成节气表文件：python -c "import bazi_analyzer as b; b.SolarTermTable.build()" """
+        epoch = datetime.datetime(first_year, 1, 1)
+        jie = [(first_year - 1, len(cls.JIE_LONGITUDES) - 1)]
+        jie += [(year, index) for year in range(first_year, last_year + 1) for index in range(len(cls.JIE_LONGITUDES))]
+        jie.append((last_year + 1, 0))
+        values = [(cls.solve_jie(year, index) - epoch) // datetime.timedelta(minutes=1) for year, index in jie]
+        with open(path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, first_year, last_year - first_year + 1))
+            f.write(struct.pack(f'<{len(values)}i', *values))
+        cls._instance = None
+
 class CalendarConverter:
     """
     历法转换模块，负责真太阳时转换以及公历向干支历的转换。
     """
+    # 日柱基准：公历序数（date.toordinal）加此偏移后模 60 即为日柱序号（0 为甲子），2000-01-01 为戊午
+    DAY_CYCLE_OFFSET = 14
+    # 出生时间的标准时区：真太阳时换算以东经 120° 标准时（UTC+8）为基准
+    STANDARD_TIMEZONE = datetime.timezone(datetime.timedelta(hours=8))
+
+    # 时差（EOT）逐日表覆盖的公历年份范围，首次使用时以 NumPy 一次性生成
+    EOT_FIRST_YEAR = 1600
+    EOT_LAST_YEAR = 2200
+    _eot_table = None
+
+    @staticmethod
+    def equation_of_time_formula(days: np.ndarray) -> np.ndarray:
+        """
+        时差公式（分钟，真太阳时 - 平太阳时），Meeus《天文算法》第 28 章，
+        days 为距 J2000.0（2000-01-01 12:00 TT）的日数，可为标量或数组。
+        """
+        t = days / 36525.0
+        l0 = np.radians(280.46646 + 36000.76983 * t + 0.0003032 * t * t)
+        m = np.radians(357.52911 + 35999.05029 * t - 0.0001537 * t * t)
+        e = 0.016708634 - 0.000042037 * t - 0.0000001267 * t * t
+        epsilon = np.radians(23.439291 - 0.0130042 * t)
+        y = np.tan(epsilon / 2) ** 2
+        eot = (y * np.sin(2 * l0) - 2 * e * np.sin(m) + 4 * e * y * np.sin(m) * np.cos(2 * l0)
+               - 0.5 * y * y * np.sin(4 * l0) - 1.25 * e * e * np.sin(2 * m))
+        return np.degrees(eot) * 4.0
+
+    @classmethod
+    def eot_table(cls) -> Tuple[int, np.ndarray, List[float]]:
+        """
+        返回 (首日公历序数, 逐日时差数组, 同内容的 list)：按东八区正午取值，标量查询使用 list 避免 NumPy 标量开销。
+        """
+        if cls._eot_table is None:
+            first = datetime.date(cls.EOT_FIRST_YEAR, 1, 1).toordinal()
+            last = datetime.date(cls.EOT_LAST_YEAR, 12, 31).toordinal()
+            # 东八区正午 = 04:00 UT；J2000.0 的公历序数为 730120.5
+            days = np.arange(first, last + 1, dtype=np.float64) + 4 / 24.0 - 730120.5
+            table = cls.equation_of_time_formula(days)
+            table.flags.writeable = False
+            cls._eot_table = (first, table, table.tolist())
+        return cls._eot_table
+
     @staticmethod
     def equation_of_time(dt: datetime.datetime) -> float:
-        # 模拟获取EOT值，真实系统需使用天文算法或查表数据
-        return -2.0
+        """返回 dt 当日的时差（分钟），表外日期直接按公式计算。"""
+        first, _, values = CalendarConverter.eot_table()
+        index = dt.toordinal() - first
+        if 0 <= index < len(values):
+            return values[index]
+        return float(CalendarConverter.equation_of_time_formula(dt.toordinal() + 4 / 24.0 - 730120.5))
+
+    @staticmethod
+    def to_standard_time(birth_time: datetime.datetime) -> datetime.datetime:
+        """带时区的出生时间换算为 UTC+8 并去掉时区；不带时区的时间视为 UTC+8，原样返回。"""
+        if birth_time.tzinfo is not None:
+            birth_time = birth_time.astimezone(CalendarConverter.STANDARD_TIMEZONE).replace(tzinfo=None)
+        return birth_time
 
     @staticmethod
     def convert_to_true_solar_time(birth_time: datetime.datetime, longitude: float) -> datetime.datetime:
@@ -198,86 +507,299 @@ class CalendarConverter:
         true_solar = mean_solar_time + datetime.timedelta(minutes=eot_minutes)
         return true_solar
 
+    @staticmethod
+    def convert_from_true_solar_time(true_solar_time: datetime.datetime, longitude: float) -> datetime.datetime:
+        """
+        convert_to_true_solar_time 的逆运算：真太阳时 -> 当地标准时。时差按标准时所在日查表，故先以真太阳时的日期
+        近似求一次，再以所得日期重算（时差逐日变化不足半分钟，一次迭代即可）。
+        """
+        offset = datetime.timedelta(hours=(longitude - 120) / 15.0)
+        civil = true_solar_time - offset - datetime.timedelta(minutes=CalendarConverter.equation_of_time(true_solar_time))
+        return true_solar_time - offset - datetime.timedelta(minutes=CalendarConverter.equation_of_time(civil))
+
+    @staticmethod
+    def convert_to_true_solar_time_batch(birth_times, longitudes) -> np.ndarray:
+        """
+        批量真太阳时转换：birth_times 为 datetime 序列或 datetime64 数组，longitudes 为等长数组（或单个经度），
+        返回 datetime64[us] 数组。时差按日查表，整批只做一次向量化运算。
+        """
+        first, table, _ = CalendarConverter.eot_table()
+        times = np.asarray(birth_times, dtype='datetime64[us]')
+        longitudes = np.broadcast_to(np.asarray(longitudes, dtype=np.float64), times.shape)
+        ordinals = times.astype('datetime64[D]').astype(np.int64) + datetime.date(1970, 1, 1).toordinal()
+        index = ordinals - first
+        in_range = (index >= 0) & (index < len(table))
+        eot_minutes = np.empty(times.shape, dtype=np.float64)
+        eot_minutes[in_range] = table[index[in_range]]
+        eot_minutes[~in_range] = CalendarConverter.equation_of_time_formula(
+            ordinals[~in_range] + 4 / 24.0 - 730120.5
+        )
+        # 与逐条转换相同，两段偏移分别取整到微秒（浮点舍入可能相差 1 微秒）
+        offset_us = np.rint((longitudes - 120) / 15.0 * 3600e6) + np.rint(eot_minutes * 60e6)
+        return times + offset_us.astype(np.int64).astype('timedelta64[us]')
+
+    @staticmethod
+    def jie_pillar_codes(n):
+        """
+        节序号 n（年份 * 12 + 年内序号，0 为小寒；标量或数组）-> (年干, 年支, 月干, 月支) 编码：立春换年，月干按五虎遁。
+        """
+        jie = n % 12
+        # 小寒至立春前仍属上一干支年
+        solar_year = n // 12 - (jie == 0)
+        year_gan, year_zhi = (solar_year - 4) % 10, (solar_year - 4) % 12
+        month_index = (jie - 1) % 12  # 寅月为 0
+        month_gan = (year_gan % 5 * 2 + 2 + month_index) % 10
+        month_zhi = (month_index + 2) % 12
+        return year_gan, year_zhi, month_gan, month_zhi
+
+    @staticmethod
+    def ganzhi_codes(birth_time: datetime.datetime) -> Tuple[List[int], List[int]]:
+        """
+        公历向干支历转换（整数编码）：返回按年、月、日、时排列的天干、地支编码。
+          - 年柱、月柱以节气表中的“节”为界（立春换年），月干按五虎遁
+          - 日柱以 23:00（子初）换日，时干按五鼠遁
+        """
+        table = SolarTermTable.load()
+        n, _ = table.locate(birth_time)
+        year_gan, year_zhi, month_gan, month_zhi = CalendarConverter.jie_pillar_codes(n)
+        day_ordinal = birth_time.toordinal() + (1 if birth_time.hour >= 23 else 0)
+        day_cycle = (day_ordinal + CalendarConverter.DAY_CYCLE_OFFSET) % 60
+        day_gan, day_zhi = day_cycle % 10, day_cycle % 12
+        hour_zhi = (birth_time.hour + 1) // 2 % 12
+        hour_gan = (day_gan % 5 * 2 + hour_zhi) % 10
+        return [year_gan, month_gan, day_gan, hour_gan], [year_zhi, month_zhi, day_zhi, hour_zhi]
+
     @staticmethod
     def convert_gregorian_to_ganzhi(birth_time: datetime.datetime) -> Dict[str, Dict[str, str]]:
         """
-        公历向干支历转换：
-        此处仅返回示例数据，真实实现需精确计算干支年、月、日、时。
+        公历向干支历转换：基于节气表精确计算干支年、月、日、时。
         """
+        gan_codes, zhi_codes = CalendarConverter.ganzhi_codes(birth_time)
         return {
-            'year': {'gan': '庚', 'zhi': '申'},
-            'month': {'gan': '乙', 'zhi': '巳'},
-            'day': {'gan': '丙', 'zhi': '午'},
-            'hour': {'gan': '戊', 'zhi': '子'}
+            pillar: {'gan': TIAN_GAN_ORDER[gan], 'zhi': DI_ZHI_ORDER[zhi]}
+            for pillar, gan, zhi in zip(PILLAR_ORDER, gan_codes, zhi_codes)
         }
 
+    @staticmethod
+    def convert_gregorian_to_ganzhi_batch(birth_times) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量公历向干支历转换：birth_times 为 datetime 序列或 datetime64 数组，
+        返回 (N, 4) 天干编码矩阵与 (N, 4) 地支编码矩阵，可直接传给 WuxingCalculator.calculate_wuxing_batch。
+        """
+        table = SolarTermTable.load()
+        times = np.asarray(birth_times, dtype='datetime64[m]')
+        minutes = (times - np.datetime64(table.epoch, 'm')).astype(np.int64)
+        k = np.searchsorted(table.minutes_array, minutes, side='right') - 1
+        if np.any(k < 0) or np.any(k >= len(table.minutes_array) - 1):
+            raise ValueError(f"birth_times outside the solar term table ({table.first_year}-{table.last_year})")
+        year_gan, year_zhi, month_gan, month_zhi = CalendarConverter.jie_pillar_codes(k + table.jie_base)
+        # 以 23:00 换日：整体平移一小时后取日序
+        epoch_ordinal = table.epoch.toordinal()
+        days, minute_of_day = np.divmod(minutes + 60, 1440)
+        day_cycle = (days + epoch_ordinal + CalendarConverter.DAY_CYCLE_OFFSET) % 60
+        day_gan, day_zhi = day_cycle % 10, day_cycle % 12
+        hour_zhi = minute_of_day // 120
+        hour_gan = (day_gan % 5 * 2 + hour_zhi) % 10
+        gan_codes = np.stack([year_gan, month_gan, day_gan, hour_gan], axis=1)
+        zhi_codes = np.stack([year_zhi, month_zhi, day_zhi, hour_zhi], axis=1)
+        return gan_codes, zhi_codes
+
+class PillarSearch:
+    """
+    四柱反查：给定四柱（可部分指定）与日期范围，返回所有排出该四柱的出生时间窗口 [start, end)。
+      - 预先按节气表建立每个节月区间的年柱、月柱编码索引，先以数组掩码筛出候选区间
+      - 日柱按模 60、时柱按模 12 直接求得，不逐分钟扫描，查询耗时为毫秒级
+    柱的写法：'庚申' 完整指定；'庚?'、'?申' 只指定干或支；'??'、None 或不提供该柱即为通配。
+    排盘以真太阳时为准（见 BatchRunner.analyze_chart）：不提供经度时查询范围与窗口均为真太阳时，
+    提供出生地经度时均为当地标准时（UTC+8），即出生记录中应填写的时间。
+    """
+    WILDCARDS = ('?', '？', '*')
+
+    def __init__(self, table: SolarTermTable = None):
+        self.table = table or SolarTermTable.load()
+        minutes = self.table.minutes_array.astype(np.int64)
+        k = np.arange(len(minutes) - 1)
+        self.starts = minutes[:-1]
+        self.ends = minutes[1:]
+        self.year_gan, self.year_zhi, self.month_gan, self.month_zhi = CalendarConverter.jie_pillar_codes(
+            k + self.table.jie_base
+        )
+        self.epoch_ordinal = self.table.epoch.toordinal()
+
+    @classmethod
+    def parse_pillar(cls, spec: str) -> Tuple[int, int]:
+        """'庚申' -> (6, 8)；通配的干或支记为 -1。"""
+        if not spec:
+            return -1, -1
+        if len(spec) != 2:
+            raise ValueError(f"invalid pillar: {spec!r}")
+        gan, zhi = spec
+        gan_code = -1 if gan in cls.WILDCARDS else GANZHI_TABLES.gan_index.get(gan)
+        zhi_code = -1 if zhi in cls.WILDCARDS else GANZHI_TABLES.zhi_index.get(zhi)
+        if gan_code is None or zhi_code is None:
+            raise ValueError(f"invalid pillar: {spec!r}")
+        return gan_code, zhi_code
+
+    @staticmethod
+    def _matches(gan: np.ndarray, zhi: np.ndarray, target: Tuple[int, int]) -> np.ndarray:
+        mask = np.ones(np.shape(gan), dtype=bool)
+        if target[0] >= 0:
+            mask &= gan == target[0]
+        if target[1] >= 0:
+            mask &= zhi == target[1]
+        return mask
+
+    def search(self, pillars: Dict[str, str], start: datetime.datetime, end: datetime.datetime,
+               longitude: float = None) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+        """
+        在 [start, end) 内查找匹配 pillars（键为 year / month / day / hour）的全部时间窗口，窗口按时间排序，相邻窗口已合并。
+        longitude 为空时 start、end 与窗口均为真太阳时（convert_gregorian_to_ganzhi 的输入），精度为分钟；
+        提供 longitude 时均为该经度的当地标准时，窗口边界由真太阳时逆推（CalendarConverter.convert_from_true_solar_time），
+        不再对齐到整分钟。
+        """
+        if longitude is not None:
+            # 真太阳时范围向外各放宽一分钟，抵消分钟取整，逆推后再截回 [start, end)
+            margin = datetime.timedelta(minutes=1)
+            windows = self.search(pillars, CalendarConverter.convert_to_true_solar_time(start, longitude) - margin,
+                                  CalendarConverter.convert_to_true_solar_time(end, longitude) + margin)
+            windows = [(max(start, CalendarConverter.convert_from_true_solar_time(s, longitude)),
+                        min(end, CalendarConverter.convert_from_true_solar_time(e, longitude))) for s, e in windows]
+            return [(s, e) for s, e in windows if s < e]
+        year_t, month_t, day_t, hour_t = (self.parse_pillar(pillars.get(p)) for p in PILLAR_ORDER)
+        lo = (start - self.table.epoch) // datetime.timedelta(minutes=1)
+        hi = (end - self.table.epoch) // datetime.timedelta(minutes=1)
+        # 1. 年柱、月柱：筛选与查询范围相交的节月区间
+        candidates = ((self.ends > lo) & (self.starts < hi)
+                      & self._matches(self.year_gan, self.year_zhi, year_t)
+                      & self._matches(self.month_gan, self.month_zhi, month_t))
+        seg_start = np.maximum(self.starts[candidates], lo)
+        seg_end = np.minimum(self.ends[candidates], hi)
+        if len(seg_start) == 0:
+            return []
+        # 2. 日柱：以 23:00 换日，第 n 日覆盖 [n * 1440 - 60, (n + 1) * 1440 - 60)
+        first_day = (seg_start + 60) // 1440
+        day_count = (seg_end - 1 + 60) // 1440 - first_day + 1
+        seg = np.repeat(np.arange(len(seg_start)), day_count)
+        days = first_day[seg] + (np.arange(len(seg)) - np.repeat(np.cumsum(day_count) - day_count, day_count))
+        cycle = (days + self.epoch_ordinal + CalendarConverter.DAY_CYCLE_OFFSET) % 60
+        day_gan, day_zhi = cycle % 10, cycle % 12
+        keep = self._matches(day_gan, day_zhi, day_t)
+        seg, days, day_gan = seg[keep], days[keep], day_gan[keep]
+        # 3. 时柱：每日 12 个时辰，时干按五鼠遁
+        if hour_t == (-1, -1):
+            win_start = days * 1440 - 60
+            win_end = win_start + 1440
+        else:
+            hours = np.arange(12)
+            hour_gan = (day_gan[:, None] % 5 * 2 + hours[None, :]) % 10
+            hit_day, hit_hour = np.nonzero(self._matches(hour_gan, np.broadcast_to(hours, hour_gan.shape), hour_t))
+            seg = seg[hit_day]
+            win_start = days[hit_day] * 1440 - 60 + hit_hour * 120
+            win_end = win_start + 120
+        win_start = np.maximum(win_start, seg_start[seg])
+        win_end = np.minimum(win_end, seg_end[seg])
+        valid = win_end > win_start
+        win_start, win_end = win_start[valid], win_end[valid]
+        # 4. 合并首尾相接的窗口并转换为 datetime
+        windows = []
+        for s, e in zip(win_start.tolist(), win_end.tolist()):
+            if windows and windows[-1][1] == s:
+                windows[-1][1] = e
+            else:
+                windows.append([s, e])
+        epoch = self.table.epoch
+        return [(epoch + datetime.timedelta(minutes=s), epoch + datetime.timedelta(minutes=e)) for s, e in windows]
+
 # ============= Module: analysis =============
 class WuxingCalculator:
     """
     五行能量计算模块，根据《三命通会》理论计算命盘中各元素得分。
     """
     @staticmethod
-    def calculate_wuxing(mingpan: MingPan, ganzhi: GanZhi) -> None:
-        total_scores = {'木': 0.0, '火': 0.0, '土': 0.0, '金': 0.0, '水': 0.0}
+    def calculate_wuxing(mingpan: MingPan, ganzhi: GanZhi = None) -> None:
+        tables = GanZhiTables.of(ganzhi)
+        gan_codes, zhi_codes = mingpan.encode_pillars()
+        total_scores = [0.0] * len(WUXING_ORDER)
         # 计算天干透出分
-        for pillar, value in mingpan.pillars.items():
-            gan = value['gan']
-            if gan in ganzhi.gan:
-                wx = ganzhi.gan[gan]['wx']
-                total_scores[wx] += 1.0
+        for gan in gan_codes:
+            if gan >= 0:
+                total_scores[tables.gan_wx[gan]] += 1.0
         # 计算地支藏干分
-        for pillar, value in mingpan.pillars.items():
-            zhi = value['zhi']
-            if zhi in ganzhi.zhi:
-                for hidden_gan, weight in ganzhi.zhi[zhi]['canggan']:
-                    wx = ganzhi.gan.get(hidden_gan, {}).get('wx', None)
-                    if wx:
-                        total_scores[wx] += 0.5 * weight
+        for zhi in zhi_codes:
+            if zhi >= 0:
+                for wx, score in tables.zhi_hidden_wx[zhi]:
+                    total_scores[wx] += score
         # 月令加成
-        month_gan = mingpan.pillars['month']['gan']
-        if month_gan in ganzhi.gan:
-            month_wx = ganzhi.gan[month_gan]['wx']
+        month_gan = gan_codes[1]
+        if month_gan >= 0:
+            month_wx = tables.gan_wx[month_gan]
             total_scores[month_wx] += 0.3 * 1.5
-        # 同根加成：示例为若年柱与月柱同五行则加成
-        if mingpan.pillars['year']['gan'] and mingpan.pillars['month']['gan']:
-            wx_year = ganzhi.gan[mingpan.pillars['year']['gan']]['wx']
-            wx_month = ganzhi.gan[mingpan.pillars['month']['gan']]['wx']
-            if wx_year == wx_month:
-                total_scores[wx_year] += 0.8
+            # 同根加成：示例为若年柱与月柱同五行则加成
+            if gan_codes[0] >= 0 and tables.gan_wx[gan_codes[0]] == month_wx:
+                total_scores[month_wx] += 0.8
         # 更新命盘五行数据
-        for element in mingpan.wuxing:
-            mingpan.wuxing[element]['score'] = total_scores[element]
+        for code, element in enumerate(WUXING_ORDER):
+            mingpan.wuxing[element]['score'] = total_scores[code]
+
+    @staticmethod
+    def calculate_wuxing_batch(gan_codes: np.ndarray, zhi_codes: np.ndarray, ganzhi: GanZhi = None) -> np.ndarray:
+        """
+        批量五行能量计算：
+          输入 gan_codes / zhi_codes 为 (N, 4) 整数矩阵（列依次为年、月、日、时，缺失为 -1），
+          返回 (N, 5) 得分矩阵，列顺序同 WUXING_ORDER。
+        累加顺序与 calculate_wuxing 完全一致（天干 -> 各柱藏干 -> 月令 -> 同根），保证逐位相同的浮点结果。
+        """
+        tables = GanZhiTables.of(ganzhi)
+        gan_wx, zhi_hidden = tables.gan_wx_array, tables.zhi_hidden
+        gan_codes = np.asarray(gan_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        zhi_codes = np.asarray(zhi_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        n = gan_codes.shape[0]
+        rows = np.arange(n)
+        scores = np.zeros((n, len(WUXING_ORDER)), dtype=np.float64)
+        # 计算天干透出分：每柱每行只命中一个五行，可直接按柱累加
+        stem_wx = gan_wx[gan_codes]
+        for p in range(len(PILLAR_ORDER)):
+            present = stem_wx[:, p] >= 0
+            scores[rows[present], stem_wx[present, p]] += 1.0
+        # 计算地支藏干分：同一地支的藏干五行互不相同，按柱依次累加即与逐项累加等价
+        for p in range(len(PILLAR_ORDER)):
+            scores += zhi_hidden[zhi_codes[:, p]]
+        # 月令加成
+        month_wx = stem_wx[:, 1]
+        has_month = month_wx >= 0
+        scores[rows[has_month], month_wx[has_month]] += 0.3 * 1.5
+        # 同根加成：年柱与月柱同五行则加成
+        same_root = has_month & (stem_wx[:, 0] == month_wx)
+        scores[rows[same_root], month_wx[same_root]] += 0.8
+        return scores
 
 class PatternDecisionTree:
     """
     格局判定决策树模块，依据《三命通会》理论判断命盘格局。
     """
+    # 全部可能的判定结果，下标即批量接口与预计算表使用的格局编码
+    PATTERN_NAMES = ["化气格", "正官格", "七杀格", "官印双清格", "曲直仁寿格", "炎上格", "标准格局"]
+
     @staticmethod
-    def decide_pattern(mingpan: MingPan, ganzhi: GanZhi) -> str:
+    def decide_pattern(mingpan: MingPan, ganzhi: GanZhi = None) -> str:
+        gan_codes, _ = mingpan.encode_pillars()
         total_tiangan_score = 0.0
-        for pillar in mingpan.pillars.values():
-            gan = pillar['gan']
-            if gan:
+        for gan in gan_codes:
+            if gan >= 0:
                 total_tiangan_score += 1.0
         if total_tiangan_score >= 4:
             special = False  # 此处可引入更多规则
             if special:
                 return "化气格"
-        month_gan = mingpan.pillars['month']['gan']
-        ten_god = ""
-        if month_gan in ['甲', '乙']:
-            ten_god = "正官"
-        elif month_gan in ['丙', '丁']:
-            ten_god = "七杀"
-        else:
-            ten_god = "其他"
-        if ten_god == "正官":
+        # 月干：甲乙（0、1）为正官，丙丁（2、3）为七杀
+        month_gan = gan_codes[1]
+        if month_gan in (0, 1):
             return "正官格"
-        elif ten_god == "七杀":
+        elif month_gan in (2, 3):
             return "七杀格"
-        if mingpan.pillars['year']['gan'] and mingpan.pillars['day']['gan']:
-            if (mingpan.pillars['year']['gan'], mingpan.pillars['day']['gan']) in [('甲', '丙'), ('乙', '丁')]:
-                return "官印双清格"
+        # 年日干：甲丙、乙丁
+        if (gan_codes[0], gan_codes[2]) in ((0, 2), (1, 3)):
+            return "官印双清格"
         element_scores = {wx: data['score'] for wx, data in mingpan.wuxing.items()}
         dominant_element = max(element_scores, key=element_scores.get)
         if dominant_element == '木':
@@ -286,84 +808,384 @@ class PatternDecisionTree:
             return "炎上格"
         return "标准格局"
 
+    @staticmethod
+    def decide_pattern_batch(gan_codes: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """
+        批量格局判定：gan_codes 为 (N, 4) 天干编码，scores 为 calculate_wuxing_batch 的 (N, 5) 得分，
+        返回 (N,) 格局编码（PATTERN_NAMES 下标），判定顺序与 decide_pattern 一致（化气格规则目前恒不成立）。
+        """
+        gan_codes = np.asarray(gan_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        names = PatternDecisionTree.PATTERN_NAMES
+        year_gan, month_gan, day_gan = gan_codes[:, 0], gan_codes[:, 1], gan_codes[:, 2]
+        # 五行最旺者：argmax 与 max(dict) 一样取并列中的第一个
+        dominant = np.argmax(scores, axis=1)
+        result = np.full(len(gan_codes), names.index("标准格局"), dtype=np.uint8)
+        result[dominant == 1] = names.index("炎上格")
+        result[dominant == 0] = names.index("曲直仁寿格")
+        guanyin = ((year_gan == 0) & (day_gan == 2)) | ((year_gan == 1) & (day_gan == 3))
+        result[guanyin] = names.index("官印双清格")
+        result[(month_gan == 2) | (month_gan == 3)] = names.index("七杀格")
+        result[(month_gan == 0) | (month_gan == 1)] = names.index("正官格")
+        return result
+
 # ============= Module: dasyun =============
 class DasYunCalculator:
     """
-    大运流年推演模块，根据命盘计算大运周期。
+    大运流年推演模块，根据命盘计算大运周期，并按年推演流年。
     """
+    STARTING_AGE = 10
+    CYCLE_YEARS = 10
+    CYCLE_COUNT = 8
+
+    @staticmethod
+    def dasyun_order(gan_code: int, gender: str) -> int:
+        """顺逆排：阳男阴女顺行（1），阴男阳女逆行（-1）；年干缺失时按逆行处理。"""
+        if gan_code >= 0 and ((gender == '男' and GANZHI_TABLES.gan_yang[gan_code]) or
+                              (gender == '女' and not GANZHI_TABLES.gan_yang[gan_code])):
+            return 1
+        return -1
+
     @staticmethod
     def calculate_dasyun(birth_gan: str, gender: str) -> List[Tuple[str, int]]:
-        if (gender == '男' and GanZhi().gan.get(birth_gan, {}).get('yy') == '阳') or \
-           (gender == '女' and GanZhi().gan.get(birth_gan, {}).get('yy') == '阴'):
-            order = 1
-        else:
-            order = -1
-        starting_age = 10
-        tian_gan_order = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
-        di_zhi_order = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
-        try:
-            idx = tian_gan_order.index(birth_gan)
-        except ValueError:
-            idx = 0
+        code = GANZHI_TABLES.encode_gan(birth_gan)
+        order = DasYunCalculator.dasyun_order(code, gender)
+        starting_age = DasYunCalculator.STARTING_AGE
+        idx = max(code, 0)
         dasyun = []
-        for i in range(8):
-            gan = tian_gan_order[(idx + order * i) % len(tian_gan_order)]
-            zhi = di_zhi_order[i % len(di_zhi_order)]
-            dasyun.append((f"{gan}{zhi}", starting_age + i * 10))
+        for i in range(DasYunCalculator.CYCLE_COUNT):
+            gan = TIAN_GAN_ORDER[(idx + order * i) % len(TIAN_GAN_ORDER)]
+            zhi = DI_ZHI_ORDER[i % len(DI_ZHI_ORDER)]
+            dasyun.append((f"{gan}{zhi}", starting_age + i * DasYunCalculator.CYCLE_YEARS))
         return dasyun
 
+    @staticmethod
+    def iter_liunian(birth_year: int, birth_gan: str, gender: str, years: int = 100) -> Iterator[Tuple[int, str, str]]:
+        """
+        按需逐年生成 (公历年, 大运, 流年)，覆盖出生年起的 years 年；起运前或八步大运之后大运为空字符串。
+        流年干支按公历年推算（(年 - 4) 模 10 / 12），不区分立春前后。
+        """
+        dasyun = DasYunCalculator.calculate_dasyun(birth_gan, gender)
+        for year in range(birth_year, birth_year + years):
+            cycle = (year - birth_year - DasYunCalculator.STARTING_AGE) // DasYunCalculator.CYCLE_YEARS
+            dayun = dasyun[cycle][0] if 0 <= cycle < len(dasyun) else ""
+            liunian = TIAN_GAN_ORDER[(year - 4) % 10] + DI_ZHI_ORDER[(year - 4) % 12]
+            yield year, dayun, liunian
+
+    @staticmethod
+    def liunian_batch(birth_years: np.ndarray, birth_gan_codes: np.ndarray, male: np.ndarray,
+                      years: int = 100) -> Dict[str, np.ndarray]:
+        """
+        批量流年推演：N 个命盘 x years 年，全部以整数编码的模运算完成，不生成逐年字典。
+          birth_years (N,)：出生公历年；birth_gan_codes (N,)：年干编码（缺失为 -1）；male (N,)：是否男命
+        返回 (N, years) 矩阵：year、liunian_gan、liunian_zhi、dayun_gan、dayun_zhi（起运前及八步之后为 -1）。
+        """
+        birth_years = np.asarray(birth_years, dtype=np.int64)
+        gan = np.asarray(birth_gan_codes, dtype=np.int64)
+        male = np.asarray(male, dtype=bool)
+        offsets = np.arange(years, dtype=np.int64)
+        year = birth_years[:, None] + offsets[None, :]
+        yang = np.array(GANZHI_TABLES.gan_yang + (False,), dtype=bool)[gan]
+        order = np.where((gan >= 0) & (male == yang), 1, -1)
+        cycle = (offsets - DasYunCalculator.STARTING_AGE) // DasYunCalculator.CYCLE_YEARS
+        active = (cycle >= 0) & (cycle < DasYunCalculator.CYCLE_COUNT)
+        dayun_gan = (np.maximum(gan, 0)[:, None] + order[:, None] * cycle[None, :]) % 10
+        dayun_zhi = np.broadcast_to(cycle % 12, year.shape)
+        return {
+            "year": year,
+            "liunian_gan": ((year - 4) % 10).astype(np.int8),
+            "liunian_zhi": ((year - 4) % 12).astype(np.int8),
+            "dayun_gan": np.where(active, dayun_gan, -1).astype(np.int8),
+            "dayun_zhi": np.where(active, dayun_zhi, -1).astype(np.int8),
+        }
+
 # ============= Module: shensha =============
 class ShenSha:
     """
     神煞判定模块，依据《三命通会》规则判断神煞状态（如天乙贵人）。
     """
+    # 天乙贵人：日干编码 -> 地支位掩码（甲戊庚见丑未、乙己见子申、丙丁见亥酉、壬癸见卯巳、辛见午寅）
+    TIANYI_ZHI_MASK: Tuple[int, ...] = tuple(
+        sum(1 << DI_ZHI_ORDER.index(z) for z in allowed)
+        for allowed in (
+            ['丑', '未'], ['子', '申'], ['亥', '酉'], ['亥', '酉'], ['丑', '未'],
+            ['子', '申'], ['丑', '未'], ['午', '寅'], ['卯', '巳'], ['卯', '巳']
+        )
+    )
+
     def check_tianyi(self, pillars: Dict[str, Dict[str, str]]) -> bool:
-        day_gan = pillars.get('day', {}).get('gan', '')
-        zhi_list = [v['zhi'] for v in pillars.values() if v.get('zhi')]
-        rules = {
-            '甲': ['丑', '未'], '戊': ['丑', '未'], '庚': ['丑', '未'],
-            '乙': ['子', '申'], '己': ['子', '申'],
-            '丙': ['亥', '酉'], '丁': ['亥', '酉'],
-            '壬': ['卯', '巳'], '癸': ['卯', '巳'],
-            '辛': ['午', '寅']
-        }
-        allowed = rules.get(day_gan, [])
-        return any(z in allowed for z in zhi_list)
+        day_gan = GANZHI_TABLES.encode_gan(pillars.get('day', {}).get('gan', ''))
+        if day_gan < 0:
+            return False
+        zhi_mask = 0
+        for v in pillars.values():
+            zhi = GANZHI_TABLES.encode_zhi(v.get('zhi', ''))
+            if zhi >= 0:
+                zhi_mask |= 1 << zhi
+        return bool(self.TIANYI_ZHI_MASK[day_gan] & zhi_mask)
+
+    @classmethod
+    def check_tianyi_batch(cls, gan_codes: np.ndarray, zhi_codes: np.ndarray) -> np.ndarray:
+        """批量天乙贵人判定：输入 (N, 4) 干支编码，返回 (N,) 布尔数组。"""
+        gan_codes = np.asarray(gan_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        zhi_codes = np.asarray(zhi_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        masks = np.array(cls.TIANYI_ZHI_MASK + (0,), dtype=np.int64)[gan_codes[:, 2]]
+        zhi_bits = np.where(zhi_codes >= 0, np.left_shift(1, np.maximum(zhi_codes, 0)), 0)
+        return (masks & np.bitwise_or.reduce(zhi_bits, axis=1)) != 0
 
 # ============= Module: custom_analyzer =============
+# 十神顺序：以日干为“我”，按 生我/同我/我生/我克/克我 与阴阳异同分类
+TEN_GOD_ORDER = ['比肩', '劫财', '食神', '伤官', '偏财', '正财', '七杀', '正官', '偏印', '正印']
+
+class CustomRuleRegistry:
+    """
+    声明式自定义规则注册表：各流派规则以字典（可来自 JSON）描述，注册时编译为 NumPy 布尔表达式，
+    对整个 ChartBatch 一次求值全部规则。规则格式：
+      {"name": "木气成林", "theory": "《子平真诠》第X章", "school": "子平", "when": 条件}
+    条件为以下之一（可嵌套）：
+      {"wuxing": "木", "op": ">", "value": 3.5}          五行得分与常数比较
+      {"wuxing": "木", "op": ">=", "other": "金"}        两个五行得分比较
+      {"pillar": "month", "gan": "甲"}                   某柱天干（可为列表，表示属于其一）
+      {"pillar": "day", "zhi": ["子", "午"]}              某柱地支
+      {"pillar": "month", "ten_god": "正官"}             某柱天干相对日干的十神
+      {"all": [...]} / {"any": [...]} / {"not": 条件}
+    school 不为空的规则只在注册表的 school 与之相同时生效。
+    """
+    # 运算符：(向量版, 标量版)
+    OPERATORS = {'>': (np.greater, operator.gt), '>=': (np.greater_equal, operator.ge),
+                 '<': (np.less, operator.lt), '<=': (np.less_equal, operator.le),
+                 '==': (np.equal, operator.eq), '!=': (np.not_equal, operator.ne)}
+
+    def __init__(self, rules: Iterable[Dict[str, Any]] = (), school: str = None):
+        self.school = school
+        self.rules: List[Dict[str, Any]] = []
+        self._predicates = []
+        self._scalar_predicates = []
+        self.uses_ten_god = False
+        for rule in rules:
+            self.register(rule)
+
+    @classmethod
+    def load(cls, path: str, school: str = None) -> 'CustomRuleRegistry':
+        """从 JSON 文件加载规则列表。"""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), school)
+
+    def register(self, rule: Dict[str, Any]) -> bool:
+        """编译并登记一条规则，返回是否生效（流派不符时忽略）；规则格式有误时抛出 ValueError。"""
+        if 'name' not in rule or 'when' not in rule:
+            raise ValueError(f"Rule must define 'name' and 'when': {rule!r}")
+        predicate, scalar_predicate, uses_ten_god = self.compile(rule['when'])
+        if rule.get('school') and self.school and rule['school'] != self.school:
+            return False
+        self.rules.append(rule)
+        self._predicates.append(predicate)
+        self._scalar_predicates.append(scalar_predicate)
+        self.uses_ten_god = self.uses_ten_god or uses_ten_god
+        return True
+
+    @classmethod
+    def compile(cls, condition: Dict[str, Any]) -> Tuple:
+        """
+        把条件编译为 (predicate, scalar_predicate, uses_ten_god)：predicate 为 columns -> (N,) bool 数组（columns 见 columns()），
+        scalar_predicate 对单个命盘的同名字段（各为列表）求值，供逐个分析时避免构造数组；uses_ten_god 表示条件是否用到十神。
+        """
+        if not isinstance(condition, dict):
+            raise ValueError(f"Condition must be a mapping: {condition!r}")
+        if 'all' in condition or 'any' in condition:
+            is_all = 'all' in condition
+            parts = [cls.compile(part) for part in condition['all' if is_all else 'any']]
+            if not parts:
+                raise ValueError(f"Empty combinator: {condition!r}")
+            combine, scalar_combine = (np.logical_and.reduce, all) if is_all else (np.logical_or.reduce, any)
+            return (lambda columns: combine([part[0](columns) for part in parts]),
+                    lambda chart: scalar_combine(part[1](chart) for part in parts),
+                    any(part[2] for part in parts))
+        if 'not' in condition:
+            inner, scalar_inner, uses_ten_god = cls.compile(condition['not'])
+            return lambda columns: ~inner(columns), lambda chart: not scalar_inner(chart), uses_ten_god
+        if 'wuxing' in condition:
+            column = cls._lookup(WUXING_ORDER, condition['wuxing'], condition)
+            if condition.get('op') not in cls.OPERATORS:
+                raise ValueError(f"Unknown operator in {condition!r}")
+            compare, scalar_compare = cls.OPERATORS[condition['op']]
+            if 'other' in condition:
+                other = cls._lookup(WUXING_ORDER, condition['other'], condition)
+                return (lambda columns: compare(columns['scores'][:, column], columns['scores'][:, other]),
+                        lambda chart: scalar_compare(chart['scores'][column], chart['scores'][other]),
+                        False)
+            try:
+                value = float(condition['value'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Condition needs a numeric 'value' or an 'other' element: {condition!r}") from None
+            return (lambda columns: compare(columns['scores'][:, column], value),
+                    lambda chart: scalar_compare(chart['scores'][column], value),
+                    False)
+        if 'pillar' in condition:
+            position = cls._lookup(PILLAR_ORDER, condition['pillar'], condition)
+            for key, order in (('gan', TIAN_GAN_ORDER), ('zhi', DI_ZHI_ORDER), ('ten_god', TEN_GOD_ORDER)):
+                if key in condition:
+                    values = condition[key] if isinstance(condition[key], list) else [condition[key]]
+                    codes = [cls._lookup(order, value, condition) for value in values]
+                    code_set = frozenset(codes)
+                    return (lambda columns: np.isin(columns[key][:, position], codes),
+                            lambda chart: chart[key][position] in code_set,
+                            key == 'ten_god')
+        raise ValueError(f"Unrecognized condition: {condition!r}")
+
+    @staticmethod
+    def _lookup(order: List[str], value: str, condition: Dict[str, Any]) -> int:
+        if value not in order:
+            raise ValueError(f"Unknown value {value!r} in {condition!r}")
+        return order.index(value)
+
+    @staticmethod
+    def ten_god_codes(gan_codes: np.ndarray) -> np.ndarray:
+        """(N, 4) 天干编码 -> (N, 4) 十神编码（TEN_GOD_ORDER 下标，缺失为 -1），以日干为“我”。"""
+        gan_codes = np.asarray(gan_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        gan_wx = GANZHI_TABLES.gan_wx_array.astype(np.int64)
+        day_gan = gan_codes[:, 2:3]
+        # 五行相对位置：0 同我、1 我生、2 我克、3 克我、4 生我；再按阴阳异同细分
+        relation = (gan_wx[gan_codes] - gan_wx[day_gan]) % 5
+        differ = (gan_codes - day_gan) % 2
+        result = (np.array([0, 2, 4, 6, 8])[relation] + differ).astype(np.int8)
+        result[(gan_codes < 0) | (day_gan < 0)] = -1
+        return result
+
+    @staticmethod
+    def ten_god_code(gan: int, day_gan: int) -> int:
+        """ten_god_codes 的标量版本。"""
+        if gan < 0 or day_gan < 0:
+            return -1
+        gan_wx = GANZHI_TABLES.gan_wx
+        return 2 * ((gan_wx[gan] - gan_wx[day_gan]) % 5) + (gan - day_gan) % 2
+
+    def columns(self, batch: 'ChartBatch') -> Dict[str, np.ndarray]:
+        """规则求值所用的列：gan / zhi / scores，以及仅在有规则用到时才计算的 ten_god。"""
+        columns = {'gan': batch.gan, 'zhi': batch.zhi, 'scores': batch.scores}
+        if self.uses_ten_god:
+            columns['ten_god'] = self.ten_god_codes(batch.gan)
+        return columns
+
+    def evaluate(self, batch: 'ChartBatch') -> np.ndarray:
+        """一次求值全部规则，返回 (N, 规则数) 布尔矩阵（列顺序同 rules）。"""
+        columns = self.columns(batch)
+        result = np.zeros((len(batch), len(self.rules)), dtype=bool)
+        for i, predicate in enumerate(self._predicates):
+            result[:, i] = predicate(columns)
+        return result
+
+    def first_match(self, batch: 'ChartBatch') -> np.ndarray:
+        """
+        每个命盘命中的第一条规则下标（注册顺序即优先级），无命中为 -1；注册表为空（或规则均被流派过滤）时全为 -1：
+
+        >>> rules = [{"name": "木气成林", "school": "子平", "when": {"wuxing": "木", "op": ">", "value": 0}}]
+        >>> batch = ChartBatch.from_datetimes([datetime.datetime(2024, 2, 4, 16, 30)] * 2).analyze()
+        >>> CustomRuleRegistry(rules, school="盲派").first_match(batch).tolist()
+        [-1, -1]
+        """
+        if not self.rules:
+            return np.full(len(batch), -1, dtype=np.int64)
+        matched = self.evaluate(batch)
+        first = np.argmax(matched, axis=1)
+        first[~matched.any(axis=1)] = -1
+        return first
+
+    def match(self, mingpan: MingPan) -> int:
+        """单个命盘命中的第一条规则下标，无命中为 -1（十神仅在有规则用到时才计算）。"""
+        gan_codes, zhi_codes = mingpan.encode_pillars()
+        chart = {'gan': gan_codes, 'zhi': zhi_codes,
+                 'scores': [mingpan.wuxing[wx]['score'] for wx in WUXING_ORDER]}
+        if self.uses_ten_god:
+            chart['ten_god'] = [self.ten_god_code(gan, gan_codes[2]) for gan in gan_codes]
+        for i, predicate in enumerate(self._scalar_predicates):
+            if predicate(chart):
+                return i
+        return -1
+
 class CustomAnalyzer:
     """
     自定义分析模块，采用插件式架构便于后续扩展更多自定义规则。
+    规则由 CustomRuleRegistry 提供（默认 DEFAULT_RULES），按注册顺序取第一条命中的规则，均未命中时返回 FALLBACK。
     """
+    DEFAULT_RULES = [
+        {"name": "木气成林", "theory": "《子平真诠》第X章", "when": {"wuxing": "木", "op": ">", "value": 3.5}},
+    ]
+    FALLBACK = {'special': '常规', 'theory': '《子平真诠》第Y章'}
+
+    def __init__(self, registry: CustomRuleRegistry = None):
+        self.registry = registry or CustomRuleRegistry(self.DEFAULT_RULES)
+
+    def result_for(self, index: int) -> Dict[str, str]:
+        if index < 0:
+            return dict(self.FALLBACK)
+        rule = self.registry.rules[index]
+        return {'special': rule['name'], 'theory': rule.get('theory', '')}
+
     def analyze(self, mingpan: MingPan) -> Dict[str, str]:
-        if mingpan.wuxing['木']['score'] > 3.5:
-            return {'special': '木气成林', 'theory': '《子平真诠》第X章'}
-        else:
-            return {'special': '常规', 'theory': '《子平真诠》第Y章'}
+        return self.result_for(self.registry.match(mingpan))
+
+    def analyze_batch(self, batch: 'ChartBatch') -> List[Dict[str, str]]:
+        return [self.result_for(index) for index in self.registry.first_match(batch).tolist()]
 
 # ============= Module: predict_model =============
 class PredictModel:
     """
     机器学习预测模块，利用历史数据预测命理重大事件。
+    特征使用 MingPan.to_vector / MingPan.feature_matrix 的定长编码；n_jobs 控制训练与推理的并行度（-1 为全部核）。
+    scikit-learn 与 joblib 导入耗时约 1 秒，只在训练、保存或加载模型时才导入，排盘与分析流程不受影响。
     """
-    def __init__(self):
+    def __init__(self, n_estimators: int = 10, n_jobs: int = None):
         self.model = None
+        self.n_estimators = n_estimators
+        self.n_jobs = n_jobs
 
-    def train(self, features: np.ndarray, labels: np.ndarray):
-        self.model = RandomForestClassifier(n_estimators=10)
+    def train(self, features: np.ndarray, labels: np.ndarray, n_jobs: int = None):
+        from sklearn.ensemble import RandomForestClassifier
+        self.model = RandomForestClassifier(n_estimators=self.n_estimators,
+                                            n_jobs=n_jobs if n_jobs is not None else self.n_jobs)
         self.model.fit(features, labels)
 
     def predict(self, mingpan: MingPan) -> np.ndarray:
+        return self.predict_many(mingpan.to_vector().reshape(1, -1))
+
+    def predict_many(self, features: np.ndarray) -> np.ndarray:
+        """批量推理：features 为 (N, F) 特征矩阵，一次 predict_proba 返回 (N, 类别数) 概率矩阵。"""
         if self.model is None:
             raise ValueError("Model is not trained.")
-        feature_vector = mingpan.to_vector().reshape(1, -1)
-        return self.model.predict_proba(feature_vector)
+        return self.model.predict_proba(np.asarray(features, dtype=np.float64))
+
+    def save(self, path: str) -> None:
+        """以 joblib 格式保存已训练模型（树结构为 NumPy 数组，读写无需逐对象 pickle）。"""
+        if self.model is None:
+            raise ValueError("Model is not trained.")
+        import joblib
+        joblib.dump(self.model, path)
+
+    @classmethod
+    def load(cls, path: str, n_jobs: int = None) -> 'PredictModel':
+        import joblib
+        model = cls(n_jobs=n_jobs)
+        model.model = joblib.load(path)
+        model.n_estimators = model.model.n_estimators
+        if n_jobs is not None:
+            model.model.n_jobs = n_jobs
+        return model
 
 # ============= Module: output =============
 class ReportGenerator:
     """
     报告输出模块，生成结构化报告，可支持JSON、HTML或PDF接口。
+    批量输出见 JsonlReportWriter（流式 JSONL）与 ColumnarReportWriter（Parquet / Arrow IPC）。
     """
+    THEORY_VERSION = "子平v3.2"
+    NOTICE = "此分析仅供参考"
+    # 每份报告都相同的字段，批量输出时可只写一次
+    STATIC_FIELDS = ("提示", "theory_version")
+
+    @staticmethod
+    def static_fields() -> Dict[str, str]:
+        return {"提示": ReportGenerator.NOTICE, "theory_version": ReportGenerator.THEORY_VERSION}
+
     @staticmethod
     def generate_report(mingpan: MingPan, pattern: str, dasyun: List[Tuple[str, int]], shensha_flags: Dict[str, bool]) -> Dict:
         report = {
@@ -371,57 +1193,1135 @@ class ReportGenerator:
             "五行": mingpan.wuxing,
             "大运": [{"大运": cycle[0], "起运年龄": cycle[1]} for cycle in dasyun],
             "神煞": shensha_flags,
-            "提示": "此分析仅供参考",
-            "theory_version": "子平v3.2"
+            "提示": ReportGenerator.NOTICE,
+            "theory_version": ReportGenerator.THEORY_VERSION
         }
         return report
 
+class JsonlReportWriter:
+    """
+    流式 JSONL 报告写出：每条报告一行、无缩进，写完即落盘，不在内存中累积。
+    omit_static=True 时首行写出 {"static": {...}}，其后各行省略 ReportGenerator.STATIC_FIELDS。
+    """
+    def __init__(self, fp: IO[str], omit_static: bool = False):
+        self.fp = fp
+        self.omit_static = omit_static
+        self.count = 0
+        if omit_static:
+            fp.write(json.dumps({"static": ReportGenerator.static_fields()}, ensure_ascii=False))
+            fp.write('\n')
+
+    @staticmethod
+    def dumps(report: Dict, omit_static: bool = False) -> str:
+        if omit_static:
+            report = {k: v for k, v in report.items() if k not in ReportGenerator.STATIC_FIELDS}
+        return json.dumps(report, ensure_ascii=False)
+
+    def write_lines(self, lines: List[str]) -> None:
+        """写出已序列化的行（例如由工作进程生成的 dumps 结果）。"""
+        if lines:
+            self.fp.write('\n'.join(lines))
+            self.fp.write('\n')
+            self.count += len(lines)
+
+    def write_batch(self, reports: Iterable[Dict]) -> None:
+        self.write_lines([self.dumps(report, self.omit_static) for report in reports])
+
+    def write(self, report: Dict) -> None:
+        self.write_lines([self.dumps(report, self.omit_static)])
+
+class ColumnarReportWriter:
+    """
+    列式报告写出（需要 pyarrow）：format 为 'parquet' 或 'arrow'（Arrow IPC 文件）。
+    每次 write_batch 将一批报告转换为一个记录批次写出；静态字段只写入 schema 元数据一次。
+    列：格局、木、火、土、金、水、大运（list<struct>）、神煞（map<string, bool>）、
+    自定义分析（struct<special, theory>，仅在使用自定义规则时有值，否则为空）、error（失败记录的错误信息）。
+    """
+    FORMATS = ('parquet', 'arrow')
+
+    def __init__(self, path: str, format: str = 'parquet'):
+        if format not in self.FORMATS:
+            raise ValueError(f"unsupported columnar format: {format}")
+        try:
+            import pyarrow as pa
+        except ImportError as exc:
+            raise ImportError("columnar output requires pyarrow (pip install pyarrow)") from exc
+        self.pa = pa
+        self.path = path
+        self.format = format
+        self.count = 0
+        self.schema = pa.schema([
+            ("格局", pa.string()),
+            *[(wx, pa.float64()) for wx in WUXING_ORDER],
+            ("大运", pa.list_(pa.struct([("大运", pa.string()), ("起运年龄", pa.int16())]))),
+            ("神煞", pa.map_(pa.string(), pa.bool_())),
+            ("自定义分析", pa.struct([("special", pa.string()), ("theory", pa.string())])),
+            ("error", pa.string()),
+        ], metadata={k.encode('utf-8'): v.encode('utf-8') for k, v in ReportGenerator.static_fields().items()})
+        if format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc as ipc
+            self._writer = ipc.new_file(path, self.schema)
+
+    def to_table(self, reports: List[Dict]):
+        pa = self.pa
+        columns = [
+            [r.get("格局") for r in reports],
+            *[[r["五行"][wx]["score"] if "五行" in r else None for r in reports] for wx in WUXING_ORDER],
+            [r.get("大运") for r in reports],
+            [list(r["神煞"].items()) if "神煞" in r else None for r in reports],
+            [r.get("自定义分析") for r in reports],
+            [r.get("error") for r in reports],
+        ]
+        arrays = [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def write_batch(self, reports: List[Dict]) -> None:
+        if reports:
+            self._writer.write_table(self.to_table(reports))
+            self.count += len(reports)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def __enter__(self) -> 'ColumnarReportWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+# ============= Module: chart_batch =============
+class ChartView:
+    """
+    ChartBatch 中单个命盘的轻量视图：只保存批次引用与行号，字段按需从列中读取。
+    """
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch: 'ChartBatch', index: int):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def gan_codes(self) -> List[int]:
+        return self.batch.gan[self.index].tolist()
+
+    @property
+    def zhi_codes(self) -> List[int]:
+        return self.batch.zhi[self.index].tolist()
+
+    @property
+    def scores(self) -> Dict[str, float]:
+        return dict(zip(WUXING_ORDER, self.batch.scores[self.index].tolist()))
+
+    @property
+    def pattern(self) -> str:
+        code = int(self.batch.pattern[self.index])
+        return PatternDecisionTree.PATTERN_NAMES[code] if code >= 0 else ''
+
+    @property
+    def pillars(self) -> Dict[str, Dict[str, str]]:
+        return {
+            pillar: {'gan': TIAN_GAN_ORDER[gan] if gan >= 0 else '',
+                     'zhi': DI_ZHI_ORDER[zhi] if zhi >= 0 else '',
+                     'ten_god': ''}
+            for pillar, gan, zhi in zip(PILLAR_ORDER, self.gan_codes, self.zhi_codes)
+        }
+
+    def to_mingpan(self) -> MingPan:
+        mingpan = MingPan()
+        mingpan.pillars = self.pillars
+        for element, score in self.scores.items():
+            mingpan.wuxing[element]['score'] = score
+        return mingpan
+
+class ChartBatch:
+    """
+    命盘批次（列式存储）：以类型化 NumPy 列代替逐个 MingPan 的嵌套字典，每个命盘约 49 字节。
+      - gan / zhi：(N, 4) int8 干支编码（缺失为 -1）
+      - scores：(N, 5) float64 五行得分（列顺序同 WUXING_ORDER）
+      - pattern：(N,) int8 格局编码（PatternDecisionTree.PATTERN_NAMES 下标，未判定为 -1）
+    按下标取得 ChartView，按切片取得共享底层数组的子批次；可与 MingPan 互相转换。
+    """
+    def __init__(self, gan: np.ndarray, zhi: np.ndarray, scores: np.ndarray = None, pattern: np.ndarray = None):
+        self.gan = np.asarray(gan, dtype=np.int8).reshape(-1, len(PILLAR_ORDER))
+        self.zhi = np.asarray(zhi, dtype=np.int8).reshape(-1, len(PILLAR_ORDER))
+        n = len(self.gan)
+        self.scores = (np.zeros((n, len(WUXING_ORDER)), dtype=np.float64) if scores is None
+                       else np.asarray(scores, dtype=np.float64).reshape(n, len(WUXING_ORDER)))
+        self.pattern = np.full(n, -1, dtype=np.int8) if pattern is None else np.asarray(pattern, dtype=np.int8)
+
+    @classmethod
+    def from_datetimes(cls, birth_times) -> 'ChartBatch':
+        """由出生时间数组排盘（见 CalendarConverter.convert_gregorian_to_ganzhi_batch）。"""
+        return cls(*CalendarConverter.convert_gregorian_to_ganzhi_batch(birth_times))
+
+    @classmethod
+    def from_mingpans(cls, mingpans: List[MingPan]) -> 'ChartBatch':
+        """由 MingPan 列表构建，五行得分取各命盘当前值，格局记为未判定。"""
+        n = len(mingpans)
+        gan = np.empty((n, len(PILLAR_ORDER)), dtype=np.int8)
+        zhi = np.empty((n, len(PILLAR_ORDER)), dtype=np.int8)
+        scores = np.empty((n, len(WUXING_ORDER)), dtype=np.float64)
+        for i, mingpan in enumerate(mingpans):
+            gan[i], zhi[i] = mingpan.encode_pillars()
+            scores[i] = [mingpan.wuxing[wx]['score'] for wx in WUXING_ORDER]
+        return cls(gan, zhi, scores)
+
+    def analyze(self, table: 'PillarTable' = None) -> 'ChartBatch':
+        """
+        计算整批的五行得分与格局（原地更新并返回自身）；提供 PillarTable 且四柱完整时直接查表。
+        """
+        complete = np.all(self.gan >= 0) and np.all(self.zhi >= 0) and np.all((self.gan - self.zhi) % 2 == 0)
+        if table is not None and complete:
+            self.scores, pattern, _ = table.lookup_batch(self.gan, self.zhi)
+            self.pattern = pattern.astype(np.int8)
+        else:
+            self.scores = WuxingCalculator.calculate_wuxing_batch(self.gan, self.zhi)
+            self.pattern = PatternDecisionTree.decide_pattern_batch(self.gan, self.scores).astype(np.int8)
+        return self
+
+    def to_mingpans(self) -> List[MingPan]:
+        return [ChartView(self, i).to_mingpan() for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.gan)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ChartBatch(self.gan[index], self.zhi[index], self.scores[index], self.pattern[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ChartBatch index out of range")
+        return ChartView(self, index)
+
+    def __iter__(self) -> Iterator[ChartView]:
+        for i in range(len(self)):
+            yield ChartView(self, i)
+
+    @property
+    def nbytes(self) -> int:
+        return self.gan.nbytes + self.zhi.nbytes + self.scores.nbytes + self.pattern.nbytes
+
+# ============= Module: compatibility =============
+class CompatibilityEngine:
+    """
+    合婚配对：以 GANZHI_TABLES 中冲、合、刑、害的 12 x 12 关系矩阵为两张命盘的地支逐对打分。
+      - 关系取双向（任一方的表中记载即算），加权合成一个对称的 12 x 12 得分矩阵 W
+      - 每个命盘按柱权重汇总为 12 维地支直方图 H，则 N x M 得分矩阵 = H_a @ W @ H_b.T，
+        与逐对比较 4 x 4 地支组合的结果相同
+      - top_k 按块计算，每块只占用 chunk_size x M 的内存
+    """
+    DEFAULT_WEIGHTS = {'he': 1.0, 'chong': -1.0, 'xing': -0.5, 'hai': -0.5}
+
+    def __init__(self, weights: Dict[str, float] = None, pillar_weights: List[float] = None):
+        self.weights = dict(self.DEFAULT_WEIGHTS, **(weights or {}))
+        self.pillar_weights = np.asarray(pillar_weights or [1.0] * len(PILLAR_ORDER), dtype=np.float64)
+        matrix = np.zeros((len(DI_ZHI_ORDER), len(DI_ZHI_ORDER)), dtype=np.float64)
+        for name, weight in self.weights.items():
+            relation = GANZHI_TABLES.relation_matrix[name]
+            matrix += weight * (relation | relation.T)
+        self.matrix = matrix
+
+    def histogram(self, zhi_codes: np.ndarray) -> np.ndarray:
+        """(N, 4) 地支编码 -> (N, 12) 按柱加权的地支直方图，缺失的柱（-1）不计。"""
+        zhi_codes = np.asarray(zhi_codes, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        hist = np.zeros((len(zhi_codes), len(DI_ZHI_ORDER)), dtype=np.float64)
+        rows = np.arange(len(zhi_codes))
+        for p in range(len(PILLAR_ORDER)):
+            present = zhi_codes[:, p] >= 0
+            hist[rows[present], zhi_codes[present, p]] += self.pillar_weights[p]
+        return hist
+
+    def score(self, zhi_a: List[int], zhi_b: List[int]) -> float:
+        """两张命盘的配对得分（逐对比较，作为批量结果的参照）。"""
+        total = 0.0
+        for p, a in enumerate(zhi_a):
+            for q, b in enumerate(zhi_b):
+                if a >= 0 and b >= 0:
+                    total += self.pillar_weights[p] * self.pillar_weights[q] * self.matrix[a, b]
+        return total
+
+    def score_matrix(self, zhi_a: np.ndarray, zhi_b: np.ndarray) -> np.ndarray:
+        """完整的 (N, M) 得分矩阵，适用于 N x M 可放入内存的情况。"""
+        return self.histogram(zhi_a) @ self.matrix @ self.histogram(zhi_b).T
+
+    def top_k(self, zhi_a: np.ndarray, zhi_b: np.ndarray, k: int = 10, chunk_size: int = 4096,
+              exclude_self: bool = False) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        逐块生成 (块起始行, (c, k) 匹配下标, (c, k) 得分)，每行按得分降序。
+        exclude_self=True 时两组为同一人群，排除与自身的配对（k 至多为 M - 1）。
+        """
+        hist_b = self.histogram(zhi_b)
+        weighted_b = self.matrix @ hist_b.T  # (12, M)
+        k = min(k, hist_b.shape[0] - 1 if exclude_self else hist_b.shape[0])
+        zhi_a = np.asarray(zhi_a, dtype=np.int64).reshape(-1, len(PILLAR_ORDER))
+        for start in range(0, len(zhi_a), chunk_size):
+            scores = self.histogram(zhi_a[start:start + chunk_size]) @ weighted_b
+            rows = np.arange(len(scores))
+            if exclude_self:
+                scores[rows, start + rows] = -np.inf
+            if k <= 0:
+                yield start, np.empty((len(rows), 0), dtype=np.int64), np.empty((len(rows), 0))
+                continue
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            part_scores = scores[rows[:, None], part]
+            order = np.argsort(-part_scores, axis=1, kind='stable')
+            yield start, part[rows[:, None], order], part_scores[rows[:, None], order]
+
+# ============= Module: pillar_table =============
+class PillarTable:
+    """
+    六十甲子四柱全组合（60^4 = 12,960,000）的预计算结果表：五行得分、格局编码、神煞标志。
+    由 build 以现有的 WuxingCalculator / PatternDecisionTree / ShenSha 逻辑（批量路径）逐年柱生成，
+    运行时内存映射，任一完整命盘只需一次下标读取。
+
+    文件格式（小端）：魔数 b'BZPT'、uint32 头部长度、UTF-8 JSON 头部（补齐到 8 字节），随后各列依次连续存放：
+      - 木、火、土、金、水（uint16）：得分的字典编码，头部 score_values 给出编码对应的浮点数（与逐条计算逐位相同）
+      - pattern（uint8）：PatternDecisionTree.PATTERN_NAMES 下标
+      - flags（uint8）：神煞位标志，第 k 位对应头部 flags[k]
+    行号 = ((年柱 * 60 + 月柱) * 60 + 日柱) * 60 + 时柱，柱序号为六十甲子序号（0 为甲子）。
+    头部指纹覆盖理论版本、天乙贵人规则、干支编码表与格局名；计算逻辑本身的改动无法指纹化，加载时另抽样重算若干行核对。
+    """
+    MAGIC = b'BZPT'
+    VERSION = 1
+    CYCLE = 60
+    COUNT = CYCLE ** 4
+    COLUMNS = [(wx, '<u2') for wx in WUXING_ORDER] + [('pattern', 'u1'), ('flags', 'u1')]
+    FLAGS = ["天乙贵人"]
+    DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pillar_table.bin')
+
+    def __init__(self, path: str = DEFAULT_PATH, fingerprint: str = None):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:4] != self.MAGIC:
+            raise ValueError(f"{path} is not a pillar table")
+        header_len, = struct.unpack_from('<I', self._mmap, 4)
+        self.header: Dict[str, Any] = json.loads(self._mmap[8:8 + header_len].decode('utf-8'))
+        if self.header['version'] != self.VERSION or self.header['count'] != self.COUNT:
+            raise ValueError(f"{path} has an unsupported layout")
+        expected = fingerprint or self.fingerprint()
+        if self.header['fingerprint'] != expected:
+            raise ValueError(f"{path} was built for another theory version or rule set, rebuild it")
+        self.score_values: List[float] = self.header['score_values']
+        self.score_values_array = np.array(self.score_values, dtype=np.float64)
+        self.patterns: List[str] = self.header['patterns']
+        offset = 8 + header_len + (-(8 + header_len)) % 8
+        self.columns: Dict[str, np.ndarray] = {}
+        # 标量读取直接切 memoryview，避免 NumPy 标量开销
+        self._views: List[memoryview] = []
+        for name, dtype in self.COLUMNS:
+            size = np.dtype(dtype).itemsize * self.COUNT
+            self.columns[name] = np.frombuffer(self._mmap, dtype=dtype, count=self.COUNT, offset=offset)
+            self._views.append(memoryview(self._mmap)[offset:offset + size].cast('H' if dtype == '<u2' else 'B'))
+            offset += size
+        if not self.verify():
+            raise ValueError(f"{path} does not match the current calculation logic, rebuild it")
+
+    @staticmethod
+    def fingerprint() -> str:
+        """表内容所依赖数据的指纹：理论版本、天乙贵人规则、GANZHI_TABLES 的五行与藏干矩阵、格局名。"""
+        digest = hashlib.sha1()
+        for arr in (GANZHI_TABLES.gan_wx_array, GANZHI_TABLES.canggan_weight, GANZHI_TABLES.zhi_hidden):
+            digest.update(np.ascontiguousarray(arr).tobytes())
+        return AnalysisCache.fingerprint(
+            ReportGenerator.THEORY_VERSION,
+            [ShenSha.TIANYI_ZHI_MASK, digest.hexdigest(), PatternDecisionTree.PATTERN_NAMES]
+        )
+
+    def verify(self, samples: int = 64, seed: int = 0) -> bool:
+        """随机抽取 samples 行，与 calculate_wuxing_batch / decide_pattern_batch / check_tianyi_batch 重算结果逐位比对。"""
+        rows = np.random.default_rng(seed).integers(0, self.COUNT, samples)
+        index = np.stack([rows // self.CYCLE ** k % self.CYCLE for k in (3, 2, 1, 0)], axis=1)
+        gan_codes, zhi_codes = index % 10, index % 12
+        scores, patterns, flags = self.lookup_batch(gan_codes, zhi_codes)
+        expected = WuxingCalculator.calculate_wuxing_batch(gan_codes, zhi_codes)
+        return (np.array_equal(scores, expected)
+                and np.array_equal(patterns, PatternDecisionTree.decide_pattern_batch(gan_codes, expected))
+                and np.array_equal(flags, ShenSha.check_tianyi_batch(gan_codes, zhi_codes)))
+
+    @staticmethod
+    def pillar_index(gan: int, zhi: int) -> int:
+        """天干、地支编码 -> 六十甲子序号（0 为甲子）；阴阳不配或缺失的组合为 -1。"""
+        if gan < 0 or zhi < 0 or (gan - zhi) % 2:
+            return -1
+        return (6 * gan - 5 * zhi) % 60
+
+    @classmethod
+    def row_index(cls, gan_codes: List[int], zhi_codes: List[int]) -> int:
+        """单个命盘的行号，四柱不完整或不合法时返回 -1。"""
+        row = 0
+        for gan, zhi in zip(gan_codes, zhi_codes):
+            p = cls.pillar_index(gan, zhi)
+            if p < 0:
+                return -1
+            row = row * cls.CYCLE + p
+        return row
+
+    def lookup(self, gan_codes: List[int], zhi_codes: List[int]):
+        """
+        返回 (五行得分列表, 格局名, 神煞标志字典)，命盘不在表中时返回 None。
+        """
+        row = self.row_index(gan_codes, zhi_codes)
+        if row < 0:
+            return None
+        views = self._views
+        scores = [self.score_values[views[i][row]] for i in range(len(WUXING_ORDER))]
+        pattern = self.patterns[views[len(WUXING_ORDER)][row]]
+        flags = views[len(WUXING_ORDER) + 1][row]
+        return scores, pattern, {name: bool(flags >> k & 1) for k, name in enumerate(self.header['flags'])}
+
+    def lookup_batch(self, gan_codes: np.ndarray, zhi_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        批量查表：输入 (N, 4) 干支编码（须为完整合法命盘），返回 (N, 5) 得分、(N,) 格局编码、(N,) 神煞标志位。
+        """
+        gan_codes = np.asarray(gan_codes, dtype=np.int64)
+        zhi_codes = np.asarray(zhi_codes, dtype=np.int64)
+        if np.any(gan_codes < 0) or np.any(zhi_codes < 0) or np.any((gan_codes - zhi_codes) % 2):
+            raise ValueError("lookup_batch requires complete, valid pillars")
+        index = (6 * gan_codes - 5 * zhi_codes) % 60
+        rows = ((index[:, 0] * self.CYCLE + index[:, 1]) * self.CYCLE + index[:, 2]) * self.CYCLE + index[:, 3]
+        scores = np.stack([self.score_values_array[self.columns[wx][rows]] for wx in WUXING_ORDER], axis=1)
+        return scores, self.columns['pattern'][rows], self.columns['flags'][rows]
+
+    @classmethod
+    def build(cls, path: str = DEFAULT_PATH) -> None:
+        """
+        生成预计算表（约 156MB）：python bazi_analyzer.py build-table [path]
+        """
+        cycle = np.arange(cls.CYCLE)
+        # 月、日、时三柱的全部组合（216,000 行），逐个年柱拼接计算
+        rest = np.stack(np.meshgrid(cycle, cycle, cycle, indexing='ij'), axis=-1).reshape(-1, 3)
+        columns = {name: np.empty(cls.COUNT, dtype=dtype) for name, dtype in cls.COLUMNS}
+        value_codes: Dict[float, int] = {}
+        for year in range(cls.CYCLE):
+            index = np.concatenate([np.full((len(rest), 1), year), rest], axis=1)
+            gan_codes, zhi_codes = index % 10, index % 12
+            scores = WuxingCalculator.calculate_wuxing_batch(gan_codes, zhi_codes)
+            # 得分字典编码：累加顺序不同的浮点结果只有数百种，以首次出现的顺序分配编码
+            uniq, inverse = np.unique(scores, return_inverse=True)
+            codes = np.array([value_codes.setdefault(float(v), len(value_codes)) for v in uniq])
+            encoded = codes[inverse.reshape(scores.shape)].astype(np.uint16)
+            rows = slice(year * len(rest), (year + 1) * len(rest))
+            for i, wx in enumerate(WUXING_ORDER):
+                columns[wx][rows] = encoded[:, i]
+            columns['pattern'][rows] = PatternDecisionTree.decide_pattern_batch(gan_codes, scores)
+            columns['flags'][rows] = ShenSha.check_tianyi_batch(gan_codes, zhi_codes)
+        header = json.dumps({
+            "version": cls.VERSION,
+            "count": cls.COUNT,
+            "fingerprint": cls.fingerprint(),
+            "score_values": sorted(value_codes, key=value_codes.get),
+            "patterns": PatternDecisionTree.PATTERN_NAMES,
+            "flags": cls.FLAGS,
+        }, ensure_ascii=False).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(b'\0' * ((-(8 + len(header))) % 8))
+            for name, _ in cls.COLUMNS:
+                f.write(columns[name].tobytes())
+
+# ============= Module: hour_sweep =============
+class HourSweep:
+    """
+    时辰未知时的批量推算：年、月、日三柱只计算一次，12 个时柱作为增量叠加，一次返回全部结果并标出随时辰变化的字段。
+      - 五行：三柱的天干、藏干分先累加好；时干只改变其五行一项，故预先算出“含时干 / 不含时干”两份前缀，
+        每个时辰按时干五行取用后再加时支藏干与月令、同根加成，累加顺序与 calculate_wuxing 相同，结果逐位一致
+      - 神煞：三柱地支先合成位掩码，每个时辰只需再并入时支
+      - 大运与时辰无关，只算一次；格局与自定义分析在 12 行上向量化判定
+    时干按五鼠遁由日干推出；子时按本日早子时处理（23:00 后的晚子时在本排盘规则中属次日）。
+    """
+    HOUR_NAMES = [f"{zhi}时" for zhi in DI_ZHI_ORDER]
+
+    def __init__(self, custom_analyzer: CustomAnalyzer = None):
+        self.custom_analyzer = custom_analyzer or CustomAnalyzer()
+
+    @staticmethod
+    def hour_codes(day_gan: int) -> Tuple[np.ndarray, np.ndarray]:
+        """12 个时柱的天干、地支编码（五鼠遁）。"""
+        hour_zhi = np.arange(len(DI_ZHI_ORDER))
+        return (day_gan % 5 * 2 + hour_zhi) % 10, hour_zhi
+
+    @staticmethod
+    def wuxing(gan_codes: List[int], zhi_codes: List[int]) -> np.ndarray:
+        """由年、月、日三柱编码求 12 个时辰的五行得分，返回 (12, 5) 矩阵。"""
+        tables = GANZHI_TABLES
+        hour_gan, hour_zhi = HourSweep.hour_codes(gan_codes[2])
+        counts = [0.0] * len(WUXING_ORDER)
+        for gan in gan_codes:
+            counts[tables.gan_wx[gan]] += 1.0
+        # 天干分为整数，先加不加时干都是精确的；其后的藏干分须在两份前缀上分别按柱累加
+        without_hour = list(counts)
+        with_hour = [count + 1.0 for count in counts]
+        for zhi in zhi_codes:
+            for wx, score in tables.zhi_hidden_wx[zhi]:
+                without_hour[wx] += score
+                with_hour[wx] += score
+        hour_wx = tables.gan_wx_array[hour_gan]
+        scores = np.where(np.arange(len(WUXING_ORDER)) == hour_wx[:, None], with_hour, without_hour)
+        scores += tables.zhi_hidden[hour_zhi]
+        # 月令加成与同根加成
+        month_wx = tables.gan_wx[gan_codes[1]]
+        scores[:, month_wx] += 0.3 * 1.5
+        if tables.gan_wx[gan_codes[0]] == month_wx:
+            scores[:, month_wx] += 0.8
+        return scores
+
+    @staticmethod
+    def tianyi(gan_codes: List[int], zhi_codes: List[int]) -> List[bool]:
+        """12 个时辰的天乙贵人判定。"""
+        mask = ShenSha.TIANYI_ZHI_MASK[gan_codes[2]]
+        zhi_mask = 0
+        for zhi in zhi_codes:
+            zhi_mask |= 1 << zhi
+        return [bool(mask & (zhi_mask | 1 << zhi)) for zhi in range(len(DI_ZHI_ORDER))]
+
+    def sweep(self, pillars: Dict[str, Dict[str, str]], gender: str) -> Dict[str, Any]:
+        """
+        pillars 只需年、月、日三柱（时柱会被忽略），返回：
+          - hours：12 项，依次为子时……亥时，含时柱与完整报告（同 ReportGenerator.generate_report）及自定义分析
+          - common：12 个时辰结果相同的字段
+          - differences：随时辰变化的字段 -> 12 个取值（按时辰顺序）
+        """
+        base = {pillar: pillars.get(pillar, {}) for pillar in PILLAR_ORDER[:3]}
+        gan_codes = [GANZHI_TABLES.encode_gan(base[pillar].get('gan', '')) for pillar in PILLAR_ORDER[:3]]
+        zhi_codes = [GANZHI_TABLES.encode_zhi(base[pillar].get('zhi', '')) for pillar in PILLAR_ORDER[:3]]
+        if min(gan_codes + zhi_codes) < 0:
+            raise ValueError("Year, month and day pillars are required for an hour sweep")
+        hour_gan, hour_zhi = self.hour_codes(gan_codes[2])
+        scores = self.wuxing(gan_codes, zhi_codes)
+        full_gan = np.column_stack([np.tile(gan_codes, (len(hour_gan), 1)), hour_gan])
+        full_zhi = np.column_stack([np.tile(zhi_codes, (len(hour_zhi), 1)), hour_zhi])
+        batch = ChartBatch(full_gan, full_zhi, scores,
+                           PatternDecisionTree.decide_pattern_batch(full_gan, scores).astype(np.int8))
+        tianyi = self.tianyi(gan_codes, zhi_codes)
+        customs = self.custom_analyzer.analyze_batch(batch)
+        dasyun = DasYunCalculator.calculate_dasyun(base['year']['gan'], gender)
+
+        hours = []
+        for i, view in enumerate(batch):
+            mingpan = view.to_mingpan()
+            report = ReportGenerator.generate_report(mingpan, view.pattern, dasyun, {"天乙贵人": tianyi[i]})
+            hours.append({"时辰": self.HOUR_NAMES[i], "时柱": mingpan.pillars['hour']['gan'] + mingpan.pillars['hour']['zhi'],
+                          "report": report, "custom": customs[i]})
+
+        fields = {"格局": [hour["report"]["格局"] for hour in hours]}
+        for code, element in enumerate(WUXING_ORDER):
+            fields[f"五行.{element}"] = scores[:, code].tolist()
+        fields["神煞.天乙贵人"] = tianyi
+        fields["自定义"] = [hour["custom"]["special"] for hour in hours]
+        common = {name: values[0] for name, values in fields.items() if all(v == values[0] for v in values)}
+        differences = {name: values for name, values in fields.items() if name not in common}
+        return {"pillars": {pillar: {'gan': base[pillar]['gan'], 'zhi': base[pillar]['zhi']} for pillar in base},
+                "hours": hours, "common": common, "differences": differences}
+
+    def sweep_date(self, date: datetime.date, gender: str) -> Dict[str, Any]:
+        """按公历日期取年、月、日三柱（取当日正午，交节当日的早晚时辰可能分属不同月柱，需另行核对）。"""
+        noon = datetime.datetime(date.year, date.month, date.day, 12)
+        return self.sweep(CalendarConverter.convert_gregorian_to_ganzhi(noon), gender)
+
+# ============= Module: profiling =============
+class StageTimer:
+    """单个阶段的计时上下文（由 StageProfiler.stage 复用，不可在同一阶段内嵌套）。"""
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: 'StageProfiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.profile is not None and self.name == profiler.profile_stage:
+            profiler.profile.enable()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter_ns() - self.start
+        profiler = self.profiler
+        if profiler.profile is not None and self.name == profiler.profile_stage:
+            profiler.profile.disable()
+        profiler.record(self.name, elapsed)
+        return False
+
+class RawProfileStats:
+    """把跨进程传回的 cProfile 原始统计包装成 pstats.Stats 可接受的对象。"""
+    def __init__(self, stats: Dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+class StageProfiler:
+    """
+    分析流程的分阶段计时：记录各阶段（calendar / wuxing / pattern / dasyun / shensha / custom / report 等）
+    的调用次数与累计墙钟时间（纳秒整数计数器），并在每次阶段结束时调用已注册的钩子 hook(stage, elapsed_ns)。
+    指定 profile_stage 时仅对该阶段开启 cProfile。批量模式下各工作进程的计数经 drain / merge 汇总到主进程，
+    此时各阶段时间为所有进程之和；钩子在主进程 merge 时按块调用，elapsed_ns 为该块内该阶段的累计时间。
+    """
+    STAGES = ('calendar', 'cache', 'table', 'wuxing', 'pattern', 'dasyun', 'shensha', 'custom', 'report')
+
+    def __init__(self, profile_stage: str = None):
+        self.profile_stage = profile_stage
+        self.profile = cProfile.Profile() if profile_stage else None
+        self.calls: Dict[str, int] = {}
+        self.elapsed: Dict[str, int] = {}
+        self.hooks: List = []
+        self._timers: Dict[str, StageTimer] = {}
+        self._profile_stats = None
+
+    def add_hook(self, hook) -> None:
+        self.hooks.append(hook)
+
+    def stage(self, name: str) -> StageTimer:
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = StageTimer(self, name)
+        return timer
+
+    def record(self, name: str, elapsed_ns: int, calls: int = 1) -> None:
+        self.calls[name] = self.calls.get(name, 0) + calls
+        self.elapsed[name] = self.elapsed.get(name, 0) + elapsed_ns
+        for hook in self.hooks:
+            hook(name, elapsed_ns)
+
+    def drain(self) -> Dict[str, Any]:
+        """取出并清零当前计数（工作进程每块调用一次，结果可 pickle）。"""
+        state = {"calls": self.calls, "elapsed": self.elapsed, "profile": None}
+        if self.profile is not None:
+            self.profile.create_stats()
+            state["profile"] = self.profile.stats
+            self.profile = cProfile.Profile()
+        self.calls, self.elapsed = {}, {}
+        return state
+
+    def merge(self, state: Dict[str, Any]) -> None:
+        """并入 drain 的结果，并以各阶段的累计增量调用钩子。"""
+        for name, calls in state["calls"].items():
+            self.record(name, state["elapsed"][name], calls)
+        if state["profile"]:
+            if self._profile_stats is None:
+                self._profile_stats = pstats.Stats(RawProfileStats(state["profile"]))
+            else:
+                self._profile_stats.add(RawProfileStats(state["profile"]))
+
+    def profile_stats(self):
+        """profile_stage 的 pstats.Stats（含本进程与已合并的工作进程），未启用时返回 None。"""
+        stats = self._profile_stats
+        if self.profile is not None:
+            self.profile.create_stats()
+            if self.profile.stats:
+                if stats is None:
+                    stats = pstats.Stats(RawProfileStats(self.profile.stats))
+                else:
+                    stats.add(RawProfileStats(self.profile.stats))
+        return stats
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """按阶段汇总：调用次数、累计秒数、平均微秒与占比。"""
+        total = sum(self.elapsed.values()) or 1
+        order = [name for name in self.STAGES if name in self.calls]
+        order += sorted(name for name in self.calls if name not in self.STAGES)
+        return {
+            name: {
+                "calls": self.calls[name],
+                "seconds": self.elapsed[name] / 1e9,
+                "mean_us": self.elapsed[name] / self.calls[name] / 1e3,
+                "share": self.elapsed[name] / total,
+            }
+            for name in order
+        }
+
+    def format_table(self) -> str:
+        lines = [f"{'阶段':<10}{'调用次数':>12}{'累计(s)':>12}{'平均(us)':>12}{'占比':>8}"]
+        for name, row in self.summary().items():
+            lines.append(f"{name:<12}{row['calls']:>12}{row['seconds']:>12.3f}{row['mean_us']:>12.2f}{row['share']:>9.1%}")
+        return "\n".join(lines)
+
+    def export(self, path: str) -> None:
+        """以 JSON 导出 summary()；启用了 profile_stage 时另写同名 .prof 文件（pstats 格式）。"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        stats = self.profile_stats()
+        if stats is not None:
+            stats.dump_stats(os.path.splitext(path)[0] + '.prof')
+
+# 未启用计时时使用的空上下文，避免在热路径上判断
+NULL_STAGE = contextlib.nullcontext()
+
+class NullProfiler:
+    """不做任何记录的 StageProfiler 替身（默认值）。"""
+    profile = None
+
+    def stage(self, name: str):
+        return NULL_STAGE
+
+NULL_PROFILER = NullProfiler()
+
+# ============= Module: cache =============
+class AnalysisCache:
+    """
+    分析结果缓存：命盘完全由四柱干支加性别决定，相同键的五行、格局、大运、神煞、自定义分析结果必然相同。
+      - 内存层为有界 LRU（maxsize 条）
+      - 可选磁盘层（SQLite，path），进程间、运行间共享
+      - 命名空间由 theory_version、神煞规则与自定义规则的指纹决定，任一变化即清空内存层，磁盘层旧条目不再命中（purge_stale 可删除）
+    缓存值在调用方之间共享，请勿原地修改。
+    """
+    def __init__(self, maxsize: int = 100000, path: str = None, theory_version: str = None, rules: Any = None,
+                 custom_rules: List[Dict[str, Any]] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self._entries: 'collections.OrderedDict[Tuple, Dict]' = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.namespace = ''
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis (namespace TEXT, key TEXT, value TEXT, PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+        self.configure(theory_version, rules, custom_rules)
+
+    @staticmethod
+    def fingerprint(theory_version: str, rules: Any) -> str:
+        payload = json.dumps([theory_version, rules], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+    def configure(self, theory_version: str = None, rules: Any = None,
+                  custom_rules: List[Dict[str, Any]] = None) -> None:
+        """
+        设置理论版本、神煞规则与自定义规则（默认为 ReportGenerator.THEORY_VERSION、内置神煞表与 CustomAnalyzer.DEFAULT_RULES），
+        变化时使缓存失效。
+        """
+        if theory_version is None:
+            theory_version = ReportGenerator.THEORY_VERSION
+        if rules is None:
+            rules = ShenSha.TIANYI_ZHI_MASK
+        if custom_rules is None:
+            custom_rules = CustomAnalyzer.DEFAULT_RULES
+        self.theory_version, self.rules, self.custom_rules = theory_version, rules, custom_rules
+        namespace = self.fingerprint(theory_version, [rules, custom_rules])
+        if namespace != self.namespace:
+            self._entries.clear()
+            self.namespace = namespace
+
+    @staticmethod
+    def make_key(gan_codes: List[int], zhi_codes: List[int], gender: str) -> Tuple:
+        return tuple(gan_codes) + tuple(zhi_codes) + (gender,)
+
+    def get(self, key: Tuple):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value FROM analysis WHERE namespace = ? AND key = ?", (self.namespace, repr(key))
+            ).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self._remember(key, value)
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple, value: Dict) -> None:
+        self._remember(key, value)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?)",
+                (self.namespace, repr(key), json.dumps(value, ensure_ascii=False))
+            )
+
+    def flush(self) -> None:
+        """提交磁盘层的未提交写入（put 不逐条提交）。"""
+        if self._db is not None:
+            self._db.commit()
+
+    def _remember(self, key: Tuple, value: Dict) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def purge_stale(self) -> int:
+        """删除磁盘层中不属于当前命名空间的条目，返回删除条数。"""
+        if self._db is None:
+            return 0
+        cursor = self._db.execute("DELETE FROM analysis WHERE namespace != ?", (self.namespace,))
+        self._db.commit()
+        return cursor.rowcount
+
+    def clear(self) -> None:
+        self._entries.clear()
+        if self._db is not None:
+            self._db.execute("DELETE FROM analysis WHERE namespace = ?", (self.namespace,))
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "namespace": self.namespace,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+class ChartAnalyzer:
+    """
+    排盘后的分析流程（五行、格局、大运、神煞、自定义分析），可选地经由 AnalysisCache 记忆化。
+    提供 PillarTable 时，完整命盘的五行、格局、神煞直接查表，不再执行规则代码。
+    提供 StageProfiler 时按阶段计时。
+    提供 CustomRuleRegistry 时以其规则做自定义分析（默认 CustomAnalyzer.DEFAULT_RULES），缓存命名空间随之变化，
+    且 report 的结果中另含“自定义分析”字段。
+    """
+    def __init__(self, cache: AnalysisCache = None, table: PillarTable = None, profiler: StageProfiler = None,
+                 registry: CustomRuleRegistry = None):
+        self.cache = cache
+        self.table = table
+        self.profiler = profiler or NULL_PROFILER
+        self.shensha = ShenSha()
+        self.custom_analyzer = CustomAnalyzer(registry)
+        self.report_custom = registry is not None
+        if cache is not None:
+            cache.configure(cache.theory_version, cache.rules, self.custom_analyzer.registry.rules)
+
+    def compute(self, pillars: Dict[str, Dict[str, str]], gender: str) -> Dict[str, Any]:
+        stage = self.profiler.stage
+        mingpan = MingPan()
+        mingpan.pillars = pillars
+        if self.table is not None:
+            with stage('table'):
+                found = self.table.lookup(*mingpan.encode_pillars())
+            if found is not None:
+                scores, pattern, shensha_flags = found
+                for element, score in zip(WUXING_ORDER, scores):
+                    mingpan.wuxing[element]['score'] = score
+                with stage('dasyun'):
+                    dasyun = DasYunCalculator.calculate_dasyun(pillars['year']['gan'], gender)
+                with stage('custom'):
+                    custom = self.custom_analyzer.analyze(mingpan)
+                return {
+                    "wuxing": mingpan.wuxing,
+                    "pattern": pattern,
+                    "dasyun": dasyun,
+                    "shensha": shensha_flags,
+                    "custom": custom,
+                }
+        with stage('wuxing'):
+            WuxingCalculator.calculate_wuxing(mingpan)
+        with stage('pattern'):
+            pattern = PatternDecisionTree.decide_pattern(mingpan)
+        with stage('dasyun'):
+            dasyun = DasYunCalculator.calculate_dasyun(pillars['year']['gan'], gender)
+        with stage('shensha'):
+            shensha_flags = {"天乙贵人": self.shensha.check_tianyi(pillars)}
+        with stage('custom'):
+            custom = self.custom_analyzer.analyze(mingpan)
+        return {
+            "wuxing": mingpan.wuxing,
+            "pattern": pattern,
+            "dasyun": dasyun,
+            "shensha": shensha_flags,
+            "custom": custom,
+        }
+
+    def analyze(self, pillars: Dict[str, Dict[str, str]], gender: str) -> Dict[str, Any]:
+        if self.cache is None or self.table is not None:
+            return self.compute(pillars, gender)
+        mingpan = MingPan()
+        mingpan.pillars = pillars
+        key = AnalysisCache.make_key(*mingpan.encode_pillars(), gender)
+        with self.profiler.stage('cache'):
+            result = self.cache.get(key)
+        if result is None:
+            result = self.compute(pillars, gender)
+            self.cache.put(key, result)
+        return result
+
+    def report(self, pillars: Dict[str, Dict[str, str]], gender: str) -> Dict:
+        result = self.analyze(pillars, gender)
+        mingpan = MingPan()
+        mingpan.pillars = pillars
+        mingpan.wuxing = result["wuxing"]
+        with self.profiler.stage('report'):
+            report = ReportGenerator.generate_report(mingpan, result["pattern"], result["dasyun"], result["shensha"])
+        if self.report_custom:
+            report["自定义分析"] = result["custom"]
+        return report
+
+# ============= Module: batch =============
+class BatchRunner:
+    """
+    批量命盘分析：流式读取出生记录（JSONL 或 CSV，字段 birth_time / longitude / gender），
+    按块分发到进程池执行完整流程，并按输入顺序写出 ReportGenerator.generate_report 的结果
+    （output_format：jsonl / parquet / arrow，见 JsonlReportWriter / ColumnarReportWriter）。
+    在途块数有上限（max_pending），内存占用与输入规模无关；吞吐随 workers 数线性扩展。
+    profile=True 时各进程按阶段计时，结束后汇总在 self.profiler 中（profile_stage 另对单一阶段开启 cProfile）。
+    rules_path 为自定义规则 JSON（CustomRuleRegistry.load，按 school 过滤），由各进程分别加载，JSONL 报告另含“自定义分析”。
+    """
+    # 每个进程一个分析器（含各自的内存缓存），由 init_worker 设置
+    analyzer: ChartAnalyzer = ChartAnalyzer()
+
+    def __init__(self, workers: int = None, chunk_size: int = 1000, max_pending: int = None,
+                 cache_size: int = 0, cache_path: str = None, table_path: str = None,
+                 output_format: str = 'jsonl', omit_static: bool = False,
+                 profile: bool = False, profile_stage: str = None, rules_path: str = None, school: str = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or self.workers * 2
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.table_path = table_path
+        self.output_format = output_format
+        self.omit_static = omit_static
+        self.profile_stage = profile_stage
+        self.profiler = StageProfiler(profile_stage) if profile or profile_stage else None
+        self.rules_path = rules_path
+        self.school = school
+
+    @staticmethod
+    def init_worker(cache_size: int, cache_path: str, table_path: str = None,
+                    profile: bool = False, profile_stage: str = None,
+                    rules_path: str = None, school: str = None) -> None:
+        cache = AnalysisCache(cache_size, cache_path) if cache_size or cache_path else None
+        table = PillarTable(table_path) if table_path else None
+        profiler = StageProfiler(profile_stage) if profile else None
+        registry = CustomRuleRegistry.load(rules_path, school) if rules_path else None
+        BatchRunner.analyzer = ChartAnalyzer(cache, table, profiler, registry)
+
+    @staticmethod
+    def analyze_chart(birth_time: datetime.datetime, longitude: float, gender: str) -> Dict:
+        """
+        对单个命例执行完整流程（与 main 相同的步骤，不打印中间结果），返回报告。
+        """
+        with BatchRunner.analyzer.profiler.stage('calendar'):
+            true_solar_time = CalendarConverter.convert_to_true_solar_time(birth_time, longitude)
+            pillars = CalendarConverter.convert_gregorian_to_ganzhi(true_solar_time)
+        return BatchRunner.analyzer.report(pillars, gender)
+
+    @staticmethod
+    def parse_record(record: Dict[str, Any]) -> Tuple[datetime.datetime, float, str]:
+        birth_time = record['birth_time']
+        if not isinstance(birth_time, datetime.datetime):
+            birth_time = datetime.datetime.fromisoformat(str(birth_time))
+        return CalendarConverter.to_standard_time(birth_time), float(record['longitude']), record['gender']
+
+    @staticmethod
+    def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+        """逐条读取出生记录：.csv 需带表头，其余按 JSONL 处理（忽略空行）。"""
+        with open(path, encoding='utf-8', newline='') as f:
+            if path.lower().endswith('.csv'):
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def iter_chunks(self, path: str) -> Iterator[List[Dict[str, Any]]]:
+        chunk = []
+        for record in self.iter_records(path):
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def process_chunk(records: List[Dict[str, Any]], serialize: bool = True, omit_static: bool = False) -> List:
+        """
+        在工作进程中分析一块记录，单条失败时输出 {"error": ...} 以保持行号对齐。
+        serialize=True 时直接返回 JSONL 行（序列化也在工作进程中完成），否则返回报告字典供列式写出。
+        """
+        reports = []
+        for record in records:
+            try:
+                report = BatchRunner.analyze_chart(*BatchRunner.parse_record(record))
+            except (KeyError, TypeError, ValueError) as exc:
+                report = {"error": f"{type(exc).__name__}: {exc}"}
+            reports.append(JsonlReportWriter.dumps(report, omit_static) if serialize else report)
+        if BatchRunner.analyzer.cache is not None:
+            BatchRunner.analyzer.cache.flush()
+        return reports
+
+    @staticmethod
+    def profile_chunk(records: List[Dict[str, Any]], serialize: bool = True, omit_static: bool = False) -> Tuple:
+        """同 process_chunk，另返回本块的分阶段计数（StageProfiler.drain）。"""
+        reports = BatchRunner.process_chunk(records, serialize, omit_static)
+        return reports, BatchRunner.analyzer.profiler.drain()
+
+    def run(self, input_path: str, output_path: str) -> int:
+        """执行批量分析，返回写出的记录数。"""
+        if self.output_format == 'jsonl':
+            with open(output_path, 'w', encoding='utf-8') as out:
+                writer = JsonlReportWriter(out, self.omit_static)
+                self._run(input_path, writer.write_lines, serialize=True)
+        else:
+            with ColumnarReportWriter(output_path, self.output_format) as writer:
+                self._run(input_path, writer.write_batch, serialize=False)
+        return writer.count
+
+    def _run(self, input_path: str, write, serialize: bool) -> None:
+        args = (serialize, self.omit_static)
+        initargs = (self.cache_size, self.cache_path, self.table_path, self.profiler is not None, self.profile_stage,
+                    self.rules_path, self.school)
+        task, emit = BatchRunner.process_chunk, write
+        if self.profiler is not None:
+            task = BatchRunner.profile_chunk
+
+            def emit(result):
+                reports, state = result
+                self.profiler.merge(state)
+                write(reports)
+        if self.workers == 1:
+            self.init_worker(*initargs)
+            for chunk in self.iter_chunks(input_path):
+                emit(task(chunk, *args))
+            return
+        with multiprocessing.Pool(self.workers, initializer=BatchRunner.init_worker, initargs=initargs) as pool:
+            # 按提交顺序取回结果，队列满时先写出最早的块，保证输出有序且内存有界
+            pending = collections.deque()
+            for chunk in self.iter_chunks(input_path):
+                pending.append(pool.apply_async(task, (chunk, *args)))
+                if len(pending) >= self.max_pending:
+                    emit(pending.popleft().get())
+            while pending:
+                emit(pending.popleft().get())
+
+def batch_main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="批量命盘分析：JSONL/CSV 出生记录 -> JSONL / Parquet / Arrow 报告")
+    parser.add_argument("input", help="输入文件（.jsonl 或 .csv，字段 birth_time, longitude, gender）")
+    parser.add_argument("output", help="输出文件")
+    parser.add_argument("--format", choices=('jsonl',) + ColumnarReportWriter.FORMATS, default='jsonl',
+                        help="输出格式，parquet / arrow 需要 pyarrow")
+    parser.add_argument("--omit-static", action="store_true", help="JSONL 输出中静态字段只在首行写一次")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="每个任务块的记录数")
+    parser.add_argument("--cache-size", type=int, default=0, help="每个进程的分析结果 LRU 缓存条数，0 表示不缓存")
+    parser.add_argument("--cache-path", default=None, help="磁盘缓存（SQLite）文件路径")
+    parser.add_argument("--table", default=None, help="预计算结果表（build-table 生成）路径")
+    parser.add_argument("--rules", default=None, help="自定义规则 JSON 文件（格式见 CustomRuleRegistry），默认使用内置规则")
+    parser.add_argument("--school", default=None, help="只启用该流派（及未标注流派）的自定义规则")
+    parser.add_argument("--profile", action="store_true", help="按阶段计时，结束时打印汇总表")
+    parser.add_argument("--profile-stage", choices=StageProfiler.STAGES, default=None,
+                        help="对该阶段开启 cProfile（隐含 --profile），打印热点函数")
+    parser.add_argument("--profile-json", default=None,
+                        help="将分阶段汇总导出为 JSON（隐含 --profile；cProfile 结果写入同名 .prof）")
+    args = parser.parse_args(argv)
+    runner = BatchRunner(workers=args.workers, chunk_size=args.chunk_size,
+                         cache_size=args.cache_size, cache_path=args.cache_path, table_path=args.table,
+                         output_format=args.format, omit_static=args.omit_static,
+                         profile=args.profile or bool(args.profile_json), profile_stage=args.profile_stage,
+                         rules_path=args.rules, school=args.school)
+    start = time.perf_counter()
+    count = runner.run(args.input, args.output)
+    print(f"已写出 {count} 条报告: {args.output}（耗时 {time.perf_counter() - start:.2f}s）")
+    if runner.profiler is not None:
+        print(runner.profiler.format_table())
+        stats = runner.profiler.profile_stats()
+        if stats is not None:
+            stats.sort_stats('cumulative').print_stats(20)
+        if args.profile_json:
+            runner.profiler.export(args.profile_json)
+
 # ============= Main Execution Module =============
-def main():
+def main(profiler: StageProfiler = None):
     # 示例输入数据
     birth_time = datetime.datetime(1711, 9, 25, 23, 0, 0)
     longitude = 116.4  # 北京经度
     gender = "男"
     school = "子平"  # 流派选择（未来可扩展支持其他流派）
+    stage = (profiler or NULL_PROFILER).stage
     
     # 1. 真太阳时转换
-    true_solar_time = CalendarConverter.convert_to_true_solar_time(birth_time, longitude)
+    with stage('calendar'):
+        true_solar_time = CalendarConverter.convert_to_true_solar_time(birth_time, longitude)
     print(f"真太阳时: {true_solar_time}")
     
-    # 2. 干支历转换
-    pillars = CalendarConverter.convert_gregorian_to_ganzhi(birth_time)
+    # 2. 干支历转换（以真太阳时排盘）
+    with stage('calendar'):
+        pillars = CalendarConverter.convert_gregorian_to_ganzhi(true_solar_time)
     mingpan = MingPan()
     mingpan.pillars = pillars
     
     # 3. 五行能量计算
     ganzhi = GanZhi()
-    WuxingCalculator.calculate_wuxing(mingpan, ganzhi)
+    with stage('wuxing'):
+        WuxingCalculator.calculate_wuxing(mingpan, ganzhi)
     print("五行得分:", mingpan.wuxing)
     
     # 4. 格局判定
-    pattern = PatternDecisionTree.decide_pattern(mingpan, ganzhi)
+    with stage('pattern'):
+        pattern = PatternDecisionTree.decide_pattern(mingpan, ganzhi)
     print("判定格局:", pattern)
     
     # 5. 大运流年推演
-    dasyun = DasYunCalculator.calculate_dasyun(mingpan.pillars['year']['gan'], gender)
+    with stage('dasyun'):
+        dasyun = DasYunCalculator.calculate_dasyun(mingpan.pillars['year']['gan'], gender)
     print("大运周期:", dasyun)
     
     # 6. 神煞判定
     shensha_system = ShenSha()
-    tianyi_flag = shensha_system.check_tianyi(mingpan.pillars)
+    with stage('shensha'):
+        tianyi_flag = shensha_system.check_tianyi(mingpan.pillars)
     shensha_flags = {"天乙贵人": tianyi_flag}
     print("神煞判定:", shensha_flags)
     
     # 7. 自定义分析
     analyzer = CustomAnalyzer()
-    custom_analysis = analyzer.analyze(mingpan)
+    with stage('custom'):
+        custom_analysis = analyzer.analyze(mingpan)
     print("自定义分析:", custom_analysis)
     
     # 8. 报告生成
-    report = ReportGenerator.generate_report(mingpan, pattern, dasyun, shensha_flags)
+    with stage('report'):
+        report = ReportGenerator.generate_report(mingpan, pattern, dasyun, shensha_flags)
     report_json = json.dumps(report, ensure_ascii=False, indent=2)
     print("命理分析报告:")
     print(report_json)
 
+    if profiler is not None:
+        print(profiler.format_table())
+        stats = profiler.profile_stats()
+        if stats is not None:
+            stats.sort_stats('cumulative').print_stats(20)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # python bazi_analyzer.py batch input.jsonl output.jsonl [--workers N] [--chunk-size N]
+    # python bazi_analyzer.py build-table [path]
+    # python bazi_analyzer.py profile [stage]
+    # python bazi_analyzer.py sweep YYYY-MM-DD [男|女]
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'profile':
+        main(StageProfiler(*sys.argv[2:3]))
+    elif len(sys.argv) > 2 and sys.argv[1] == 'sweep':
+        result = HourSweep().sweep_date(datetime.date.fromisoformat(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else "男")
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'build-table':
+        PillarTable.build(*sys.argv[2:3])
+    else:
+        main()
\ No newline at end of file
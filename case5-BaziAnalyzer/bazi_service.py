@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+八字分析 HTTP 服务：常驻进程，避免每次调用都重新导入 NumPy / scikit-learn。
+启动时建好预热的进程池（每个工作进程加载一次干支表、节气表、均时差表、可选的预计算结果表与 PredictModel），
+CPU 密集的排盘与分析在进程池中执行，事件循环只负责收发请求。
+
+环境变量：
+  BAZI_WORKERS      工作进程数，默认 CPU 核数
+  BAZI_CHUNK_SIZE   批量接口每个任务块的命例数，默认 256
+  BAZI_MODEL_PATH   PredictModel.save 保存的模型文件（可选，提供后可请求预测）
+  BAZI_TABLE_PATH   build-table 生成的预计算结果表（可选）
+  BAZI_CACHE_SIZE   每个工作进程的分析结果 LRU 缓存条数，默认 0
+  BAZI_RULES_PATH   自定义规则 JSON 文件（可选，格式见 CustomRuleRegistry）
+
+安装：pip install -r requirements.txt（scikit-learn / joblib 仅预测需要）
+运行：python bazi_service.py  或  uvicorn bazi_service:app --port 8001
+"""
+
+import asyncio
+import contextlib
+import datetime
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, Field, field_validator
+
+from bazi_analyzer import (
+    AnalysisCache, BatchRunner, CalendarConverter, ChartAnalyzer, CustomRuleRegistry, MingPan, PillarTable,
+    PredictModel, SolarTermTable
+)
+
+WORKERS = int(os.environ.get("BAZI_WORKERS") or os.cpu_count() or 1)
+CHUNK_SIZE = int(os.environ.get("BAZI_CHUNK_SIZE", 256))
+MODEL_PATH = os.environ.get("BAZI_MODEL_PATH") or None
+TABLE_PATH = os.environ.get("BAZI_TABLE_PATH") or None
+CACHE_SIZE = int(os.environ.get("BAZI_CACHE_SIZE", 0))
+RULES_PATH = os.environ.get("BAZI_RULES_PATH") or None
+MAX_BATCH = 100000
+
+class ChartInput(BaseModel):
+    birth_time: datetime.datetime
+    longitude: float = Field(116.4, ge=-180, le=180)
+    gender: str = Field("男", pattern="^(男|女)$")
+
+    @field_validator("birth_time")
+    @classmethod
+    def to_standard_time(cls, value: datetime.datetime) -> datetime.datetime:
+        """与批量模式相同（BatchRunner.parse_record），统一换算为不带时区的 UTC+8 时间。"""
+        return CalendarConverter.to_standard_time(value)
+
+class ChartRequest(ChartInput):
+    predict: bool = False
+
+class BatchRequest(BaseModel):
+    charts: List[ChartInput] = Field(..., max_length=MAX_BATCH)
+    predict: bool = False
+
+# ------------- 工作进程 -------------
+# 每个工作进程一份，由 init_worker 设置
+worker_model: Optional[PredictModel] = None
+worker_barrier = None
+
+def init_worker(model_path: str, table_path: str, cache_size: int, barrier=None, rules_path: str = None) -> None:
+    """进程池初始化：加载各类常驻表、自定义规则与模型，之后的请求只做计算。"""
+    global worker_model, worker_barrier
+    worker_barrier = barrier
+    SolarTermTable.load()
+    CalendarConverter.eot_table()
+    cache = AnalysisCache(cache_size) if cache_size else None
+    table = PillarTable(table_path) if table_path else None
+    registry = CustomRuleRegistry.load(rules_path) if rules_path else None
+    BatchRunner.analyzer = ChartAnalyzer(cache, table, registry=registry)
+    worker_model = PredictModel.load(model_path, n_jobs=1) if model_path else None
+
+def warm_up() -> int:
+    """
+    走一遍完整流程以摊销首次调用的开销；随后在屏障处等待，使每个预热任务落在不同的进程上
+    （进程池按需创建进程，否则空闲进程可能连续领取多个预热任务）。
+    """
+    analyze_charts([{"birth_time": datetime.datetime(2000, 1, 1), "longitude": 116.4, "gender": "男"}], False)
+    if worker_barrier is not None:
+        worker_barrier.wait(timeout=60)
+    return os.getpid()
+
+def analyze_charts(records: List[Dict[str, Any]], predict: bool) -> List[Dict[str, Any]]:
+    """
+    在工作进程中分析一组命例，返回 {"pillars", "report"[, "预测"]} 列表；单条失败时为 {"error": ...}，保持顺序对齐。
+    预测对整组命例一次调用 predict_many。
+    """
+    results = []
+    mingpans = []
+    for record in records:
+        try:
+            birth_time, longitude, gender = BatchRunner.parse_record(record)
+            true_solar_time = CalendarConverter.convert_to_true_solar_time(birth_time, longitude)
+            pillars = CalendarConverter.convert_gregorian_to_ganzhi(true_solar_time)
+            report = BatchRunner.analyzer.report(pillars, gender)
+        except (KeyError, TypeError, ValueError) as exc:
+            results.append({"error": f"{type(exc).__name__}: {exc}"})
+            continue
+        results.append({"pillars": pillars, "report": report})
+        if predict:
+            mingpan = MingPan()
+            mingpan.pillars = pillars
+            mingpan.wuxing = report["五行"]
+            mingpans.append((len(results) - 1, mingpan))
+    if predict and worker_model is not None and mingpans:
+        features = [mingpan.to_vector() for _, mingpan in mingpans]
+        probabilities = worker_model.predict_many(features)
+        classes = [str(label) for label in worker_model.model.classes_]
+        for (index, _), row in zip(mingpans, probabilities.tolist()):
+            results[index]["预测"] = dict(zip(classes, row))
+    return results
+
+# ------------- 服务 -------------
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    barrier = multiprocessing.Barrier(WORKERS)
+    pool = ProcessPoolExecutor(WORKERS, initializer=init_worker,
+                               initargs=(MODEL_PATH, TABLE_PATH, CACHE_SIZE, barrier, RULES_PATH))
+    loop = asyncio.get_running_loop()
+    pids = await asyncio.gather(*(loop.run_in_executor(pool, warm_up) for _ in range(WORKERS)))
+    app.state.pool = pool
+    app.state.worker_pids = sorted(set(pids))
+    try:
+        yield
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+app = FastAPI(title="Bazi Analyzer", lifespan=lifespan)
+
+async def run_in_pool(records: List[Dict[str, Any]], predict: bool) -> List[Dict[str, Any]]:
+    """按 CHUNK_SIZE 分块提交到进程池，并按输入顺序拼接结果。"""
+    if predict and MODEL_PATH is None:
+        raise HTTPException(status_code=400, detail="预测模型未加载（设置 BAZI_MODEL_PATH）")
+    loop = asyncio.get_running_loop()
+    chunks = [records[i:i + CHUNK_SIZE] for i in range(0, len(records), CHUNK_SIZE)]
+    parts = await asyncio.gather(
+        *(loop.run_in_executor(app.state.pool, analyze_charts, chunk, predict) for chunk in chunks)
+    )
+    return [result for part in parts for result in part]
+
+@app.post("/analyze")
+async def analyze(chart: ChartRequest):
+    result = (await run_in_pool([chart.model_dump(exclude={"predict"})], chart.predict))[0]
+    if "error" in result:
+        raise HTTPException(status_code=422, detail=result["error"])
+    return result
+
+@app.post("/analyze/batch")
+async def analyze_batch(batch: BatchRequest):
+    results = await run_in_pool([chart.model_dump() for chart in batch.charts], batch.predict)
+    return {"count": len(results), "results": results}
+
+@app.get("/health")
+async def health():
+    return {
+        "workers": len(app.state.worker_pids),
+        "model_loaded": MODEL_PATH is not None,
+        "table_loaded": TABLE_PATH is not None,
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("bazi_service:app", host="0.0.0.0", port=8001)
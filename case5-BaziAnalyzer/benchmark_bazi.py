@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+八字分析流程基准测试：对各阶段及完整流程，在 1k / 100k / 1M 规模的合成命盘上测量吞吐（命盘/秒）与峰值内存，
+可保存基线并在吞吐回退超过阈值时以非零状态退出，便于接入 CI。
+批量阶段处理整个人群的 NumPy 数组；逐条阶段循环复用至多 POOL_SIZE 个命盘对象，内存占用与规模无关。
+--startup 另以 python -X importtime 测量 bazi_analyzer 的导入耗时，并确认默认流程（main）不会导入 scikit-learn 等重型依赖。
+
+用法：
+  python benchmark_bazi.py                                  # 默认规模 1000 100000 1000000
+  python benchmark_bazi.py --sizes 1000 100000 --save-baseline
+  python benchmark_bazi.py --sizes 1000 --threshold 0.2     # 与基线比较，低于基线 80% 即失败
+  python benchmark_bazi.py --startup --sizes                 # 只检查启动耗时
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from bazi_analyzer import (
+    BatchRunner, CalendarConverter, DasYunCalculator, MingPan, PatternDecisionTree,
+    ReportGenerator, WuxingCalculator, PILLAR_ORDER, TIAN_GAN_ORDER, DI_ZHI_ORDER
+)
+from shensha_system import ShenSha
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+RULES_PATH = os.path.join(HERE, ' shensha_rules.json')
+DEFAULT_SIZES = [1000, 100000, 1000000]
+# 逐条阶段使用的命盘对象个数上限（按规模循环复用）
+POOL_SIZE = 10000
+# 只应在请求预测时才导入的模块
+HEAVY_MODULES = ('sklearn', 'joblib', 'scipy')
+STARTUP_SCRIPT = "import bazi_analyzer, contextlib, io\nwith contextlib.redirect_stdout(io.StringIO()): bazi_analyzer.main()"
+
+
+def synthetic_population(size: int, seed: int = 0) -> Dict[str, object]:
+    """
+    生成 size 个合成命例（1900-2100 年间均匀分布的出生时间、中国境内经度），返回整数编码数组，
+    以及前 POOL_SIZE 个命例的 MingPan 列表与 (出生时间, 经度, 性别) 列表，供逐条阶段循环使用。
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('1900-03-01T00:00', 'm')
+    minutes = rng.integers(0, 200 * 365 * 1440, size)
+    times = start + minutes.astype('timedelta64[m]')
+    gan_codes, zhi_codes = CalendarConverter.convert_gregorian_to_ganzhi_batch(times)
+    genders = np.where(rng.random(size) < 0.5, '男', '女')
+    longitudes = rng.uniform(73.5, 135.0, size)
+    pool = min(size, POOL_SIZE)
+    births = list(zip(times[:pool].tolist(), longitudes[:pool].tolist(), genders[:pool].tolist()))
+    mingpans = []
+    for gans, zhis in zip(gan_codes[:pool].tolist(), zhi_codes[:pool].tolist()):
+        mingpan = MingPan()
+        mingpan.pillars = {
+            pillar: {'gan': TIAN_GAN_ORDER[g], 'zhi': DI_ZHI_ORDER[z], 'ten_god': ''}
+            for pillar, g, z in zip(PILLAR_ORDER, gans, zhis)
+        }
+        mingpans.append(mingpan)
+    return {'size': size, 'times': times, 'gan': gan_codes, 'zhi': zhi_codes,
+            'genders': genders[:pool].tolist(), 'mingpans': mingpans, 'births': births}
+
+
+def cycle(items: List, size: int):
+    """循环取 items 直到共 size 个。"""
+    return itertools.islice(itertools.cycle(items), size)
+
+
+def build_stages(population: Dict[str, object]) -> Dict[str, Callable[[], None]]:
+    """各阶段的被测函数：每个函数处理整个人群（size 个命例）一遍。"""
+    size: int = population['size']
+    mingpans: List[MingPan] = population['mingpans']
+    genders: List[str] = population['genders']
+    births = population['births']
+    with open(RULES_PATH, encoding='utf-8') as f:
+        shensha = ShenSha(json.load(f))
+    # 报告生成阶段需要预先算好的五行、格局、大运、神煞
+    for mingpan in mingpans:
+        WuxingCalculator.calculate_wuxing(mingpan)
+    patterns = [PatternDecisionTree.decide_pattern(m) for m in mingpans]
+    dasyuns = [DasYunCalculator.calculate_dasyun(m.pillars['year']['gan'], g) for m, g in zip(mingpans, genders)]
+    flags = [{"天乙贵人": True}] * len(mingpans)
+
+    def wuxing():
+        for mingpan in cycle(mingpans, size):
+            WuxingCalculator.calculate_wuxing(mingpan)
+
+    def pattern():
+        for mingpan in cycle(mingpans, size):
+            PatternDecisionTree.decide_pattern(mingpan)
+
+    def dasyun():
+        for mingpan, gender in cycle(list(zip(mingpans, genders)), size):
+            DasYunCalculator.calculate_dasyun(mingpan.pillars['year']['gan'], gender)
+
+    def shensha_evaluate():
+        for mingpan in cycle(mingpans, size):
+            shensha.evaluate(mingpan.pillars)
+
+    def report():
+        for mingpan, p, d, s in cycle(list(zip(mingpans, patterns, dasyuns, flags)), size):
+            ReportGenerator.generate_report(mingpan, p, d, s)
+
+    def pipeline():
+        # 与 batch 模式相同的完整流程：真太阳时、排盘、分析与报告
+        for birth_time, longitude, gender in cycle(births, size):
+            BatchRunner.analyze_chart(birth_time, longitude, gender)
+
+    def wuxing_batch():
+        WuxingCalculator.calculate_wuxing_batch(population['gan'], population['zhi'])
+
+    def convert_batch():
+        CalendarConverter.convert_gregorian_to_ganzhi_batch(population['times'])
+
+    return {
+        'calculate_wuxing': wuxing,
+        'decide_pattern': pattern,
+        'calculate_dasyun': dasyun,
+        'shensha_evaluate': shensha_evaluate,
+        'generate_report': report,
+        'pipeline': pipeline,
+        'calculate_wuxing_batch': wuxing_batch,
+        'convert_gregorian_to_ganzhi_batch': convert_batch,
+    }
+
+
+def measure(func: Callable[[], None], size: int, repeat: int, memory: bool) -> Dict[str, float]:
+    """取 repeat 次中最快的一次计算吞吐；memory 为真时另跑一遍以 tracemalloc 记录峰值内存（避免影响计时）。"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    result = {'seconds': best, 'charts_per_sec': size / best if best > 0 else float('inf')}
+    if memory:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak_mib'] = peak / 2 ** 20
+    return result
+
+
+def measure_startup(repeat: int) -> Dict[str, Any]:
+    """
+    以 python -X importtime 运行默认流程，取 repeat 次中 bazi_analyzer 导入累计耗时的最小值（毫秒），
+    并列出被导入的重型模块（应为空）。
+    """
+    best = float('inf')
+    heavy = set()
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+                              cwd=HERE, capture_output=True, text=True, check=True)
+        for line in proc.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            parts = line.split('|')
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            module = parts[2].strip()
+            if module == 'bazi_analyzer':
+                best = min(best, int(parts[1]) / 1000)
+            if module.split('.')[0] in HEAVY_MODULES:
+                heavy.add(module.split('.')[0])
+    return {'import_ms': best, 'heavy_modules': sorted(heavy)}
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Dict, threshold: float) -> List[str]:
+    """返回吞吐低于基线 (1 - threshold) 倍的条目说明。"""
+    regressions = []
+    for stage, by_size in results.items():
+        for size, result in by_size.items():
+            base = baseline.get(stage, {}).get(size)
+            if base is None:
+                continue
+            floor = base['charts_per_sec'] * (1 - threshold)
+            if result['charts_per_sec'] < floor:
+                regressions.append(
+                    f"{stage} @ {size}: {result['charts_per_sec']:.0f}/s < {floor:.0f}/s "
+                    f"(基线 {base['charts_per_sec']:.0f}/s, 阈值 {threshold:.0%})"
+                )
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="八字分析流程基准测试")
+    parser.add_argument("--sizes", type=int, nargs='*', default=DEFAULT_SIZES, help="合成人群规模（留空则不测吞吐）")
+    parser.add_argument("--startup", action="store_true", help="测量导入耗时并检查重型依赖是否被提前导入")
+    parser.add_argument("--stages", nargs='+', default=None, help="只运行指定阶段（默认全部）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最快一次")
+    parser.add_argument("--no-memory", action="store_true", help="不测量峰值内存")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果写入基线文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的吞吐回退比例")
+    parser.add_argument("--json", default=None, help="将本次结果另存为 JSON")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for size in args.sizes:
+        population = synthetic_population(size)
+        stages = build_stages(population)
+        for name in args.stages or stages:
+            result = measure(stages[name], size, args.repeat, not args.no_memory)
+            results.setdefault(name, {})[str(size)] = result
+            memory = f"{result['peak_mib']:9.1f} MiB" if 'peak_mib' in result else ''
+            print(f"{name:<36}{size:>9}  {result['charts_per_sec']:>14,.0f} 命盘/秒  {memory}", flush=True)
+    startup = None
+    if args.startup:
+        startup = measure_startup(args.repeat)
+        heavy = ', '.join(startup['heavy_modules']) or '无'
+        print(f"{'startup':<36}{'':>9}  {startup['import_ms']:>14.1f} ms      重型依赖: {heavy}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(results, startup=startup) if startup else results, f, ensure_ascii=False, indent=2)
+    if startup and startup['heavy_modules']:
+        print("默认流程导入了重型依赖：" + ', '.join(startup['heavy_modules']))
+        return 1
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        for name, by_size in results.items():
+            baseline.setdefault(name, {}).update(by_size)
+        if startup:
+            baseline['startup'] = {'import_ms': startup['import_ms']}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存: {args.baseline}")
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if startup and 'startup' in baseline:
+            ceiling = baseline['startup']['import_ms'] * (1 + args.threshold)
+            if startup['import_ms'] > ceiling:
+                regressions.append(f"startup: {startup['import_ms']:.1f} ms > {ceiling:.1f} ms "
+                                   f"(基线 {baseline['startup']['import_ms']:.1f} ms, 阈值 {args.threshold:.0%})")
+        if regressions:
+            print("吞吐回退：")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("未发现超过阈值的吞吐回退。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
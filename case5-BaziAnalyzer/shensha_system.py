@@ -1,5 +1,13 @@
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Stems and branches in canonical order; their list index is the integer code used by the compiled tables.
+TIAN_GAN = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
+DI_ZHI = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
+GAN_INDEX = {gan: code for code, gan in enumerate(TIAN_GAN)}
+ZHI_INDEX = {zhi: code for code, zhi in enumerate(DI_ZHI)}
 
 class ShenShaRule:
     """
@@ -43,6 +51,95 @@ class ShenShaRule:
                     return True
         return False
 
+class CompiledShenShaRules:
+    """
+    A list of ShenShaRule objects compiled into a day-stem x branch lookup table.
+
+    table[day_gan][zhi] is an integer bitmask whose bit r is set when rule r triggers for
+    that day stem and a pillar carrying that branch. A chart is therefore evaluated by OR-ing
+    the table entries of its four branches, independent of how many rules are loaded.
+    For batches the same table is exposed as a (10, 13, words) uint64 array; row 12 stands
+    for a missing branch (code -1) and is always zero.
+    """
+    def __init__(self, rules: List[ShenShaRule]):
+        self.rules = rules
+        self.names = [rule.name for rule in rules]
+        table = [[0] * len(DI_ZHI) for _ in TIAN_GAN]
+        for r, rule in enumerate(rules):
+            allowed = [ZHI_INDEX[z] for z in rule.conditions.get("allowed_zhi", []) if z in ZHI_INDEX]
+            for gan in rule.conditions.get("day_gan", []):
+                if gan in GAN_INDEX:
+                    for z in allowed:
+                        table[GAN_INDEX[gan]][z] |= 1 << r
+        self.table: Tuple[Tuple[int, ...], ...] = tuple(tuple(row) for row in table)
+        self._word_table = None
+
+    @staticmethod
+    def encode(pillars: Dict[str, Dict[str, str]]) -> Tuple[int, List[int]]:
+        """
+        Encode pillars as (day stem code, branch codes); unknown or missing values become -1.
+        """
+        day_gan = GAN_INDEX.get(pillars.get("day", {}).get("gan", ""), -1)
+        zhi_codes = [ZHI_INDEX.get(v.get("zhi", ""), -1) for v in pillars.values()]
+        return day_gan, zhi_codes
+
+    def match_mask(self, day_gan: int, zhi_codes: Sequence[int]) -> int:
+        """
+        Return the bitmask of rules triggered by an encoded chart.
+        """
+        if day_gan < 0:
+            return 0
+        row = self.table[day_gan]
+        mask = 0
+        for zhi in zhi_codes:
+            if zhi >= 0:
+                mask |= row[zhi]
+        return mask
+
+    def names_for(self, mask: int) -> List[str]:
+        """
+        Translate a rule bitmask into rule names, in rule order.
+        """
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self.names[low.bit_length() - 1])
+            mask ^= low
+        return names
+
+    def match(self, pillars: Dict[str, Dict[str, str]]) -> List[str]:
+        return self.names_for(self.match_mask(*self.encode(pillars)))
+
+    @property
+    def word_table(self) -> np.ndarray:
+        if self._word_table is None:
+            words = max(1, (len(self.rules) + 63) // 64)
+            table = np.zeros((len(TIAN_GAN), len(DI_ZHI) + 1, words), dtype=np.uint64)
+            for g, row in enumerate(self.table):
+                for z, mask in enumerate(row):
+                    for w in range(words):
+                        table[g, z, w] = (mask >> (64 * w)) & 0xFFFFFFFFFFFFFFFF
+            table.flags.writeable = False
+            self._word_table = table
+        return self._word_table
+
+    def match_batch(self, day_gan: np.ndarray, zhi_codes: np.ndarray) -> np.ndarray:
+        """
+        Evaluate every rule against N encoded charts at once.
+
+        day_gan is an (N,) array of day stem codes and zhi_codes an (N, P) array of branch
+        codes (-1 for missing). Returns an (N, len(rules)) boolean matrix.
+        """
+        day_gan = np.asarray(day_gan, dtype=np.int64)
+        zhi_codes = np.asarray(zhi_codes, dtype=np.int64).reshape(len(day_gan), -1)
+        table = self.word_table
+        valid = day_gan >= 0
+        words = np.bitwise_or.reduce(table[np.where(valid, day_gan, 0)[:, None], zhi_codes], axis=1)
+        words[~valid] = 0
+        bits = np.arange(len(self.rules))
+        shifts = (bits % 64).astype(np.uint64)
+        return ((words[:, bits // 64] >> shifts) & np.uint64(1)).astype(bool)
+
 class ShenShaRuleLoader:
     """
     ShenShaRuleLoader loads rules from already-loaded JSON data (a list of dictionaries).
@@ -50,6 +147,12 @@ class ShenShaRuleLoader:
     def __init__(self, rules_data: List[Dict[str, Any]]):
         self.rules_data = rules_data
 
+    def compile_rules(self) -> CompiledShenShaRules:
+        """
+        Load the rules and compile them into bitmask lookup tables.
+        """
+        return CompiledShenShaRules(self.load_rules())
+
     def load_rules(self) -> List[ShenShaRule]:
         rules = []
         for rule_data in self.rules_data:
@@ -67,11 +170,21 @@ class ShenSha:
       - Contains an internal implementation for Tianyi Guiren.
       - Uses an external JSON data list (loaded into Python) to load additional ShenSha rules.
     """
+    # Tianyi Guiren expressed as rules so it shares the compiled bitmask path (see check_tianyi).
+    TIANYI_RULES = CompiledShenShaRules([
+        ShenShaRule("天乙贵人", "", {"day_gan": ["甲", "戊", "庚"], "allowed_zhi": ["丑", "未"]}),
+        ShenShaRule("天乙贵人", "", {"day_gan": ["乙", "己"], "allowed_zhi": ["子", "申"]}),
+        ShenShaRule("天乙贵人", "", {"day_gan": ["丙", "丁"], "allowed_zhi": ["亥", "酉"]}),
+        ShenShaRule("天乙贵人", "", {"day_gan": ["壬", "癸"], "allowed_zhi": ["卯", "巳"]}),
+        ShenShaRule("天乙贵人", "", {"day_gan": ["辛"], "allowed_zhi": ["午", "寅"]}),
+    ])
+
     def __init__(self, rules_data: List[Dict[str, Any]] = None):
         self.custom_rules: List[ShenShaRule] = []
         if rules_data:
             loader = ShenShaRuleLoader(rules_data)
             self.custom_rules = loader.load_rules()
+        self.compiled_rules = CompiledShenShaRules(self.custom_rules)
 
     def check_tianyi(self, pillars: Dict[str, Dict[str, str]]) -> bool:
         """
@@ -82,29 +195,15 @@ class ShenSha:
           - Bing, Ding   → corresponding branches Hai, You.
           - Ren, Gui   → corresponding branches Mao, Si.
           - Xin       → corresponding branches Wu, Chen.
-        (The mapping below is an example and can be adjusted to match the exact text.)
-        """
-        day_gan = pillars.get('day', {}).get('gan', '')
-        zhi_list = [v.get('zhi', '') for v in pillars.values()]
-        rules = {
-            '甲': ['丑', '未'], '戊': ['丑', '未'], '庚': ['丑', '未'],
-            '乙': ['子', '申'], '己': ['子', '申'],
-            '丙': ['亥', '酉'], '丁': ['亥', '酉'],
-            '壬': ['卯', '巳'], '癸': ['卯', '巳'],
-            '辛': ['午', '寅']
-        }
-        allowed = rules.get(day_gan, [])
-        return any(z in allowed for z in zhi_list)
+        (The mapping in TIANYI_RULES is an example and can be adjusted to match the exact text.)
+        """
+        return self.TIANYI_RULES.match_mask(*CompiledShenShaRules.encode(pillars)) != 0
 
     def check_custom_shensha(self, pillars: Dict[str, Dict[str, str]]) -> List[str]:
         """
         Checks all loaded external ShenSha rules and returns a list of rule names that trigger.
         """
-        triggered = []
-        for rule in self.custom_rules:
-            if rule.check(pillars):
-                triggered.append(rule.name)
-        return triggered
+        return self.compiled_rules.match(pillars)
 
     def evaluate(self, pillars: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
         """
@@ -116,6 +215,20 @@ class ShenSha:
         result["自定义神煞"] = self.check_custom_shensha(pillars)
         return result
 
+    def evaluate_batch(self, day_gan: np.ndarray, zhi_codes: np.ndarray) -> Dict[str, Any]:
+        """
+        Evaluates the internal and external rules for N encoded charts at once.
+
+        day_gan is an (N,) array of day stem codes, zhi_codes an (N, 4) array of branch codes
+        (see CompiledShenShaRules.encode). Returns "天乙贵人" as an (N,) boolean array and
+        "自定义神煞" as an (N, len(custom_rules)) boolean matrix whose columns follow "rule_names".
+        """
+        return {
+            "天乙贵人": self.TIANYI_RULES.match_batch(day_gan, zhi_codes).any(axis=1),
+            "自定义神煞": self.compiled_rules.match_batch(day_gan, zhi_codes),
+            "rule_names": self.compiled_rules.names,
+        }
+
 # -------------------------------
 # Example usage:
 # -------------------------------
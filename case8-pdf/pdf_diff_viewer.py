@@ -1,22 +1,43 @@
 import fitz  # PyMuPDF
 import diff_match_patch as dmp_module
-import sys
-from pathlib import Path
-import pandas as pd
+import argparse
+import contextlib
+import difflib
+import hashlib
 import html
+import itertools
+import json
+import math
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
 def extract_pdf_text_by_page(pdf_path):
     doc = fitz.open(pdf_path)
     return [page.get_text() for page in doc]
 
+def get_page_count(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
 def escape_and_format_html(text):
     if not text:
         return ""
     return html.escape(text).replace("\n", "<br>")
 
+# 关闭 diff_match_patch 默认 1 秒的墙钟超时：超时后结果取决于机器负载，串行与并行、前后两次运行可能不同；
+# 关闭后每页都算出完整差异，结果确定，代价是改动极大的页面耗时更长
+DIFF_TIMEOUT = 0
+# 影响比较结果的参数，作为差异缓存键的一部分
+_DEFAULT_DMP = dmp_module.diff_match_patch()
+DIFF_SETTINGS = f"timeout={DIFF_TIMEOUT};edit_cost={_DEFAULT_DMP.Diff_EditCost};cleanup=semantic"
+
 def compare_texts(old_text, new_text):
     dmp = dmp_module.diff_match_patch()
+    dmp.Diff_Timeout = DIFF_TIMEOUT
     diffs = dmp.diff_main(old_text, new_text)
     dmp.diff_cleanupSemantic(diffs)
 
@@ -36,44 +57,387 @@ def compare_texts(old_text, new_text):
 
     return additions, deletions, clean_html
 
-def compare_pdf_versions_with_html(pdf_old_path, pdf_new_path):
-    old_pages = extract_pdf_text_by_page(pdf_old_path)
-    new_pages = extract_pdf_text_by_page(pdf_new_path)
-    max_pages = max(len(old_pages), len(new_pages))
+def iter_page_range(pdf_old_path, pdf_new_path, start, stop):
+    """
+    逐页比较第 start ~ stop-1 页（从 0 起），依次产出有差异的页结果。
+    并行模式下每个工作进程各自打开 PDF，进程间只传递路径与页码范围，不传递 fitz 文档对象。
+    """
+    with fitz.open(pdf_old_path) as old_doc, fitz.open(pdf_new_path) as new_doc:
+        for i in range(start, stop):
+            old_text = old_doc[i].get_text() if i < old_doc.page_count else ""
+            new_text = new_doc[i].get_text() if i < new_doc.page_count else ""
+            if old_text == new_text:
+                continue  # 内容相同，无需逐字比较
+            added, deleted, html_diff = compare_texts(old_text, new_text)
+
+            if not added and not deleted:
+                continue  # 跳过无变化页
+
+            yield {
+                "Page": i + 1,
+                "Added": "; ".join(added),
+                "Deleted": "; ".join(deleted),
+                "HTML Diff": html_diff
+            }
+
+def compare_page_range(pdf_old_path, pdf_new_path, start, stop):
+    return list(iter_page_range(pdf_old_path, pdf_new_path, start, stop))
+
+def page_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def align_pages(old_hashes, new_hashes):
+    """
+    按内容指纹对齐两个版本的页序列，只返回有变化的页，按新版本顺序排列的 (状态, 旧页下标, 新页下标) 列表：
+      修改：位置对应但内容不同；新增 / 删除：另一侧为 None；移动：内容相同、位置改变。
+    指纹相同且顺序一致的页不出现在结果中，因此插入一页只会产生一条“新增”，不会让其后所有页都变成“修改”。
+    """
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    blocks = [op for op in matcher.get_opcodes() if op[0] != "equal"]
+
+    # 未对齐的旧页中若有与未对齐新页内容相同者，视为移动
+    unmatched_old = {}
+    for _, i1, i2, _, _ in blocks:
+        for i in range(i1, i2):
+            unmatched_old.setdefault(old_hashes[i], []).append(i)
+    moved = {}
+    for _, _, _, j1, j2 in blocks:
+        for j in range(j1, j2):
+            candidates = unmatched_old.get(new_hashes[j])
+            if candidates:
+                moved[j] = candidates.pop(0)
+    moved_old = set(moved.values())
+
+    operations = []
+    for _, i1, i2, j1, j2 in blocks:
+        olds = [i for i in range(i1, i2) if i not in moved_old]
+        news = [j for j in range(j1, j2) if j not in moved]
+        operations.extend(("移动", moved[j], j) for j in range(j1, j2) if j in moved)
+        operations.extend(("修改", i, j) for i, j in zip(olds, news))
+        operations.extend(("新增", None, j) for j in news[len(olds):])
+        operations.extend(("删除", i, None) for i in olds[len(news):])
+    return operations
+
+class DiffCache:
+    """
+    磁盘缓存（SQLite）：
+      - 页面文本：按 PDF 文件内容哈希 + 页码保存（同时保存页面指纹），同一文件再次比较时无需重新提取；
+      - 页面差异：按 (旧页指纹, 新页指纹, 比较参数) 保存 compare_texts 的结果，内容未变的页对直接复用。
+    每次写入页面文本及每写入 EVICT_INTERVAL 条差异后检查一次总大小，超过 max_bytes 时按最近使用时间淘汰，
+    长时间运行或比较大量文件时磁盘占用同样有界；close 时提交剩余写入并再检查一次。
+    """
+    EVICT_INTERVAL = 256
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._diff_writes = 0
+        self._touched = {"pages": set(), "diffs": set()}
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (file_hash TEXT PRIMARY KEY, page_count INTEGER, last_used REAL);
+            CREATE TABLE IF NOT EXISTS pages (file_hash TEXT, page INTEGER, page_hash TEXT, text TEXT, size INTEGER,
+                                              PRIMARY KEY (file_hash, page));
+            CREATE TABLE IF NOT EXISTS diffs (key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL);
+        """)
+
+    @staticmethod
+    def file_hash(pdf_path):
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get_pages(self, file_hash):
+        """返回 (页面文本列表, 页面指纹列表)，未缓存时返回 None。"""
+        row = self.db.execute("SELECT page_count FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        rows = self.db.execute("SELECT text, page_hash FROM pages WHERE file_hash = ? ORDER BY page",
+                               (file_hash,)).fetchall()
+        if len(rows) != row[0]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched["pages"].add(file_hash)
+        return [text for text, _ in rows], [page_hash for _, page_hash in rows]
+
+    def put_pages(self, file_hash, texts, hashes):
+        with self.db:
+            self.db.execute("DELETE FROM pages WHERE file_hash = ?", (file_hash,))
+            self.db.executemany(
+                "INSERT INTO pages VALUES (?, ?, ?, ?, ?)",
+                [(file_hash, i, h, text, len(text.encode("utf-8"))) for i, (text, h) in enumerate(zip(texts, hashes))]
+            )
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (file_hash, len(texts), time.time()))
+        self.evict()
+
+    @staticmethod
+    def diff_key(old_hash, new_hash):
+        return f"{old_hash}:{new_hash}:{DIFF_SETTINGS}"
+
+    def get_diff(self, key):
+        row = self.db.execute("SELECT value FROM diffs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched["diffs"].add(key)
+        added, deleted, html_diff = json.loads(row[0])
+        return added, deleted, html_diff
+
+    def put_diff(self, key, result):
+        value = json.dumps(result, ensure_ascii=False)
+        self.db.execute("INSERT OR REPLACE INTO diffs VALUES (?, ?, ?, ?)",
+                        (key, value, len(value.encode("utf-8")), time.time()))
+        self._diff_writes += 1
+        if self._diff_writes % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def size(self):
+        pages = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        diffs = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM diffs").fetchone()[0]
+        return pages + diffs
+
+    def touch(self):
+        """把本次命中条目的最近使用时间写入数据库，使淘汰时不会先删掉刚用过的条目。"""
+        now = time.time()
+        with self.db:
+            self.db.executemany("UPDATE files SET last_used = ? WHERE file_hash = ?",
+                                [(now, key) for key in self._touched["pages"]])
+            self.db.executemany("UPDATE diffs SET last_used = ? WHERE key = ?",
+                                [(now, key) for key in self._touched["diffs"]])
+        self._touched = {"pages": set(), "diffs": set()}
+
+    def evict(self):
+        """按最近使用时间淘汰文件（连同其全部页面）与差异结果，直到总大小不超过 max_bytes。"""
+        self.touch()
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        entries = self.db.execute("""
+            SELECT 'files', files.file_hash, files.last_used, COALESCE(SUM(pages.size), 0)
+            FROM files LEFT JOIN pages ON pages.file_hash = files.file_hash GROUP BY files.file_hash
+            UNION ALL SELECT 'diffs', key, last_used, size FROM diffs
+            ORDER BY 3
+        """).fetchall()
+        with self.db:
+            for table, key, _, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if table == "files":
+                    self.db.execute("DELETE FROM pages WHERE file_hash = ?", (key,))
+                    self.db.execute("DELETE FROM files WHERE file_hash = ?", (key,))
+                else:
+                    self.db.execute("DELETE FROM diffs WHERE key = ?", (key,))
+                total -= size
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def load_pages(pdf_path, cache=None):
+    """提取全部页面文本与指纹；提供 cache 时按文件内容哈希复用。"""
+    if cache is not None:
+        file_hash = cache.file_hash(pdf_path)
+        cached = cache.get_pages(file_hash)
+        if cached is not None:
+            return cached
+    texts = extract_pdf_text_by_page(pdf_path)
+    hashes = [page_hash(text) for text in texts]
+    if cache is not None:
+        cache.put_pages(file_hash, texts, hashes)
+    return texts, hashes
+
+def diff_page_pairs(pairs, workers=1, cache=None, pool=None):
+    """
+    对 (旧文本, 旧指纹, 新文本, 新指纹) 列表依次产出 compare_texts 的结果；
+    缓存命中的直接返回，其余（可并行）计算后写入缓存。提供 pool（workers 个进程）时复用之，否则按需新建。
+    """
+    cached = [cache.get_diff(cache.diff_key(old_hash, new_hash)) if cache is not None else None
+              for _, old_hash, _, new_hash in pairs]
+    missing = [pair for pair, result in zip(pairs, cached) if result is None]
+    old_texts = [old_text for old_text, _, _, _ in missing]
+    new_texts = [new_text for _, _, new_text, _ in missing]
+    with contextlib.ExitStack() as stack:
+        if workers > 1 and len(missing) > 1:
+            if pool is None:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            computed = pool.map(compare_texts, old_texts, new_texts, chunksize=max(1, len(missing) // (workers * 4)))
+        else:
+            computed = map(compare_texts, old_texts, new_texts)
+        for (old_text, old_hash, new_text, new_hash), result in zip(pairs, cached):
+            if result is None:
+                result = next(computed)
+                if cache is not None:
+                    cache.put_diff(cache.diff_key(old_hash, new_hash), result)
+            yield result
+
+def iter_aligned_pages(pdf_old_path, pdf_new_path, workers=1, cache=None):
+    """
+    按内容对齐后比较：先提取两版全部页面并计算指纹，只对“修改 / 新增 / 删除”的页调用 compare_texts，
+    耗时与变化页数成正比。结果除 Page（新版页码，删除页取旧版页码）外另含 Status、Old Page、New Page。
+    """
+    old_pages, old_hashes = load_pages(pdf_old_path, cache)
+    new_pages, new_hashes = load_pages(pdf_new_path, cache)
+    yield from iter_aligned_texts(old_pages, old_hashes, new_pages, new_hashes, workers, cache)
 
-    results = []
-    for i in range(max_pages):
-        old_text = old_pages[i] if i < len(old_pages) else ""
-        new_text = new_pages[i] if i < len(new_pages) else ""
-        added, deleted, html_diff = compare_texts(old_text, new_text)
+def iter_aligned_texts(old_pages, old_hashes, new_pages, new_hashes, workers=1, cache=None, pool=None):
+    """iter_aligned_pages 的主体：对已提取的两版页面文本与指纹做对齐比较（pool 见 diff_page_pairs）。"""
+    operations = align_pages(old_hashes, new_hashes)
 
+    empty = page_hash("")
+    pairs = [(old_pages[i] if i is not None else "", old_hashes[i] if i is not None else empty,
+              new_pages[j] if j is not None else "", new_hashes[j] if j is not None else empty)
+             for status, i, j in operations if status != "移动"]
+    diffs = diff_page_pairs(pairs, workers, cache, pool)
+
+    # 需比较的页与 operations 同序，逐个取用比较结果
+    for status, i, j in operations:
+        added, deleted, html_diff = ([], [], "") if status == "移动" else next(diffs)
+        if status == "修改" and not added and not deleted:
+            continue  # 仅空白差异
+        yield {
+            "Page": (j if j is not None else i) + 1,
+            "Status": status,
+            "Old Page": i + 1 if i is not None else None,
+            "New Page": j + 1 if j is not None else None,
+            "Added": "; ".join(added),
+            "Deleted": "; ".join(deleted),
+            "HTML Diff": html_diff
+        }
+
+def iter_chain_diffs(pdf_paths, workers=1, cache=None, pool=None):
+    """
+    版本链比较 v1→v2→…→vN：依次产出 (i, j, rows)，i、j 为版本下标，rows 为该段有差异页的迭代器（同 iter_aligned_pages），
+    须在取下一段之前消费完。每个版本只提取一次文本、计算一次指纹，供前后两段比较共用，总工作量与版本数成线性关系。
+    版本数多于 2 时最后再产出累计视图 (0, N-1, rows)：v1 与 vN 直接对齐比较，只比较两者间实际变化的页。
+    内存中只保留 v1、上一版本与当前版本的页面文本。各段共用同一个进程池 pool（见 diff_page_pairs）。
+    """
+    first = previous = load_pages(pdf_paths[0], cache)
+    for k in range(1, len(pdf_paths)):
+        current = load_pages(pdf_paths[k], cache)
+        yield k - 1, k, iter_aligned_texts(*previous, *current, workers, cache, pool)
+        previous = current
+    if len(pdf_paths) > 2:
+        yield 0, len(pdf_paths) - 1, iter_aligned_texts(*first, *previous, workers, cache, pool)
+
+def iter_cached_pages(pdf_old_path, pdf_new_path, workers=1, cache=None):
+    """按页码逐页比较（结果同 iter_page_range），页面文本与差异经由 cache 复用。"""
+    old_pages, old_hashes = load_pages(pdf_old_path, cache)
+    new_pages, new_hashes = load_pages(pdf_new_path, cache)
+    empty = page_hash("")
+    pages = []
+    for i in range(max(len(old_pages), len(new_pages))):
+        old_hash = old_hashes[i] if i < len(old_pages) else empty
+        new_hash = new_hashes[i] if i < len(new_pages) else empty
+        if old_hash != new_hash:
+            pages.append(i)
+    pairs = [(old_pages[i] if i < len(old_pages) else "", old_hashes[i] if i < len(old_pages) else empty,
+              new_pages[i] if i < len(new_pages) else "", new_hashes[i] if i < len(new_pages) else empty)
+             for i in pages]
+    for i, (added, deleted, html_diff) in zip(pages, diff_page_pairs(pairs, workers, cache)):
         if not added and not deleted:
             continue  # 跳过无变化页
-
-        results.append({
+        yield {
             "Page": i + 1,
             "Added": "; ".join(added),
             "Deleted": "; ".join(deleted),
             "HTML Diff": html_diff
-        })
+        }
+
+def describe_page(row):
+    """结果行的锚点与标题（按页码比较时只有 Page；按内容对齐时另有 Status 等列）。"""
+    status = row.get("Status")
+    if not status:
+        return f"page{row['Page']}", f"第 {row['Page']} 页"
+    old_page, new_page = row["Old Page"], row["New Page"]
+    if status == "删除":
+        return f"old{old_page}", f"旧版第 {old_page} 页（已删除）"
+    if status == "新增":
+        return f"page{new_page}", f"第 {new_page} 页（新增）"
+    if status == "移动":
+        return f"page{new_page}", f"第 {new_page} 页（由旧版第 {old_page} 页移动而来，内容未变）"
+    if old_page != new_page:
+        return f"page{new_page}", f"第 {new_page} 页（旧版第 {old_page} 页）"
+    return f"page{new_page}", f"第 {new_page} 页"
+
+def iter_page_diffs(pdf_old_path, pdf_new_path, workers=1, shard_size=None, align=False, cache=None):
+    """
+    逐页比较两个版本，按页序依次产出有差异的页（字典：Page、Added、Deleted、HTML Diff），
+    每页比较完即可交给 HtmlReportWriter 写出，不在内存中累积全部结果。
+    workers > 1 时把页码范围切成若干分片交给进程池并行处理，按分片顺序取回结果；
+    compare_texts 不设超时（DIFF_TIMEOUT），结果与串行模式逐页相同。
+    align=True 时按页面内容指纹对齐（见 iter_aligned_pages），能识别插入、删除与移动的页。
+    提供 cache（DiffCache）时页面文本与逐页差异均从磁盘缓存复用，只有新出现的页对才需要比较。
+    """
+    if align:
+        yield from iter_aligned_pages(pdf_old_path, pdf_new_path, workers, cache)
+        return
+    if cache is not None:
+        yield from iter_cached_pages(pdf_old_path, pdf_new_path, workers, cache)
+        return
+
+    max_pages = max(get_page_count(pdf_old_path), get_page_count(pdf_new_path))
+
+    if workers <= 1 or max_pages <= 1:
+        yield from iter_page_range(pdf_old_path, pdf_new_path, 0, max_pages)
+        return
+
+    # 每个进程分到约 4 个分片，变化集中在某一段时也能较均衡
+    shard_size = shard_size or max(1, math.ceil(max_pages / (workers * 4)))
+    starts = list(range(0, max_pages, shard_size))
+    stops = [min(start + shard_size, max_pages) for start in starts]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for shard in pool.map(compare_page_range, itertools.repeat(str(pdf_old_path)),
+                              itertools.repeat(str(pdf_new_path)), starts, stops):
+            yield from shard
 
-    return pd.DataFrame(results)
+def compare_pdf_versions_with_html(pdf_old_path, pdf_new_path, workers=1, shard_size=None, align=False, cache=None):
+    """返回全部有差异页的列表（参数同 iter_page_diffs）。"""
+    return list(iter_page_diffs(pdf_old_path, pdf_new_path, workers, shard_size, align, cache))
 
-def generate_full_html_report(results_df, output_file="diff_report.html", title="PDF 差异对比报告"):
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(f"""<!DOCTYPE html>
+class HtmlReportWriter:
+    """
+    流式 HTML 报告：每页差异比较完即写出该页章节并落盘，只在内存中保留目录项（锚点与标题）。
+    目录在 close 时追加到文件末尾，借助 CSS flex 的 order 显示在页面顶部，无需回写文件开头。
+    版本链报告用 section 分段：段内各页的锚点加上段锚点前缀，目录按段分组。
+    """
+    def __init__(self, output_file="diff_report.html", title="PDF 差异对比报告"):
+        self.output_file = output_file
+        self.title = title
+        self.toc = []
+        self.prefix = ""
+        self.section_rows = None
+        self.f = open(output_file, "w", encoding="utf-8")
+        self.f.write(f"""<!DOCTYPE html>
 <html lang="zh">
 <head>
   <meta charset="UTF-8">
   <title>{title}</title>
   <style>
-    body {{ font-family: 'Segoe UI', sans-serif; margin: 40px; line-height: 1.8; background: #f9f9f9; }}
+    body {{ display: flex; flex-direction: column; font-family: 'Segoe UI', sans-serif; margin: 40px; line-height: 1.8; background: #f9f9f9; }}
     h1 {{ color: #333; }}
     h2 {{ color: #444; }}
-    .toc {{ background: #fff; border: 1px solid #ccc; padding: 15px; border-radius: 10px; }}
+    .report-header {{ order: -2; }}
+    .toc {{ order: -1; background: #fff; border: 1px solid #ccc; padding: 15px; border-radius: 10px; }}
     .toc summary {{ font-size: 18px; font-weight: bold; cursor: pointer; }}
     .toc ul {{ padding-left: 20px; }}
     .toc a {{ text-decoration: none; color: #2a7ae2; }}
+    .toc .toc-section {{ font-weight: bold; margin-top: 8px; }}
+    .chain-section {{ margin-top: 60px; border-bottom: 2px solid #2a7ae2; }}
     .diff-section {{ border: 1px solid #ddd; background: #fff; padding: 20px; border-radius: 12px; margin-top: 40px; }}
     .diff-section h2 {{ margin-top: 0; }}
     ins {{
@@ -106,58 +470,148 @@ def generate_full_html_report(results_df, output_file="diff_report.html", title=
   </style>
 </head>
 <body>
-  <h1>{title}</h1>
-  <p>生成时间：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
-  <hr/>
+  <header class="report-header" id="top">
+    <h1>{title}</h1>
+    <p>生成时间：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
+    <hr/>
+  </header>
 
+""")
+
+    def section(self, anchor, title):
+        """开始新的一段（如版本链中的一次变更）；上一段没有任何差异页时补写说明。"""
+        self.end_section()
+        self.prefix = f"{anchor}-"
+        self.section_rows = 0
+        self.toc.append((anchor, title, "toc-section"))
+        self.f.write(f'<h2 class="chain-section" id="{anchor}">🔗 {title}</h2>\n')
+        self.f.flush()
+
+    def end_section(self):
+        if self.section_rows == 0:
+            self.f.write('<p><em>（本段无任何内容变更）</em></p>\n')
+        self.section_rows = None
+
+    def write(self, row):
+        anchor, label = describe_page(row)
+        anchor = self.prefix + anchor
+        self.toc.append((anchor, label, ""))
+        if self.section_rows is not None:
+            self.section_rows += 1
+        f = self.f
+        f.write(f'<section class="diff-section" id="{anchor}">\n')
+        f.write(f'<h2>📄 {label} 差异内容</h2>\n')
+        f.write(f'<p>{row["HTML Diff"] or "<em>（本页无实际差异）</em>"}</p>')
+        f.write(f'<div class="top-link"><a href="#top">↑ 返回顶部</a></div>\n')
+        f.write('</section>\n')
+        f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.end_section()
+        f = self.f
+        f.write("""
   <details class="toc" open>
     <summary>📑 差异目录导航</summary>
     <ul>
 """)
-        for _, row in results_df.iterrows():
-            f.write(f'<li><a href="#page{row["Page"]}">第 {row["Page"]} 页</a></li>\n')
-
-        f.write("</ul></details><hr/>")
-
-        for _, row in results_df.iterrows():
-            f.write(f'<section class="diff-section" id="page{row["Page"]}">\n')
-            f.write(f'<h2>📄 第 {row["Page"]} 页 差异内容</h2>\n')
-            f.write(f'<p>{row["HTML Diff"] or "<em>（本页无实际差异）</em>"}</p>')
-            f.write(f'<div class="top-link"><a href="#top">↑ 返回顶部</a></div>\n')
-            f.write('</section>\n')
+        for anchor, label, css_class in self.toc:
+            attr = f' class="{css_class}"' if css_class else ""
+            f.write(f'<li{attr}><a href="#{anchor}">{label}</a></li>\n')
+        f.write("</ul></details>")
 
         f.write(f"""<footer>
   PDF 差异比对工具生成 © {datetime.now().year} | 使用 ChatGPT + PyMuPDF + DiffMatchPatch 自动生成
 </footer>
 </body></html>""")
+        f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def generate_full_html_report(results, output_file="diff_report.html", title="PDF 差异对比报告"):
+    with HtmlReportWriter(output_file, title) as writer:
+        for row in results:
+            writer.write(row)
+
+def print_row(row):
+    print(f"📘 {describe_page(row)[1]}差异：")
+    print(f"  ➕ 新增: {row['Added'][:100]}{'...' if len(row['Added']) > 100 else ''}")
+    print(f"  ➖ 删除: {row['Deleted'][:100]}{'...' if len(row['Deleted']) > 100 else ''}")
+
+def run_chain(pdf_paths, output_file, workers=1, cache=None):
+    """版本链模式：各段差异与 v1→vN 累计视图写入同一份报告（见 iter_chain_diffs），各段共用一个进程池。"""
+    names = [f"v{k + 1}（{path.name}）" for k, path in enumerate(pdf_paths)]
+    with contextlib.ExitStack() as stack:
+        writer = stack.enter_context(HtmlReportWriter(output_file, "PDF 版本链差异报告"))
+        pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers)) if workers > 1 else None
+        for i, j, rows in iter_chain_diffs(pdf_paths, workers, cache, pool):
+            cumulative = j - i > 1
+            title = f"{'累计变更' if cumulative else '变更'}：{names[i]} → {names[j]}"
+            print(f"\n🔗 {title}")
+            writer.section(f"v{i + 1}-v{j + 1}", title)
+            count = 0
+            for row in rows:
+                print_row(row)
+                writer.write(row)
+                count += 1
+            if not count:
+                print("🎉 两个版本完全一致，无任何内容变更。")
 
 def main():
-    if len(sys.argv) != 3:
-        print("用法: python pdf_diff_viewer.py old_version.pdf new_version.pdf")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="PDF 差异对比：python pdf_diff_viewer.py old_version.pdf new_version.pdf [v3.pdf ...]")
+    parser.add_argument("old", help="旧版本 PDF")
+    parser.add_argument("new", help="新版本 PDF")
+    parser.add_argument("more", nargs="*", help="后续版本 PDF（共三个及以上时按版本链比较：每个版本只提取一次，输出各段差异与累计差异）")
+    parser.add_argument("--workers", type=int, default=1, help="并行进程数（默认 1，即串行）")
+    parser.add_argument("--align", action="store_true", help="按页面内容对齐（识别插入、删除、移动的页），而非按页码逐页比较")
+    parser.add_argument("--output", default="diff_report.html", help="HTML 报告路径")
+    parser.add_argument("--cache", default=None, help="磁盘缓存（SQLite）路径，重复比较时复用页面文本与差异结果")
+    parser.add_argument("--cache-size", type=int, default=512, help="磁盘缓存上限（MB）")
+    args = parser.parse_args()
 
-    pdf_old_path = Path(sys.argv[1])
-    pdf_new_path = Path(sys.argv[2])
+    pdf_old_path = Path(args.old)
+    pdf_new_path = Path(args.new)
+    pdf_paths = [pdf_old_path, pdf_new_path] + [Path(path) for path in args.more]
 
-    if not pdf_old_path.exists() or not pdf_new_path.exists():
+    if not all(path.exists() for path in pdf_paths):
         print("❌ 错误：指定的PDF文件不存在。")
         sys.exit(1)
 
-    print(f"🔍 正在比较以下PDF版本：\n📄 旧版本：{pdf_old_path}\n📄 新版本：{pdf_new_path}\n")
-
-    results = compare_pdf_versions_with_html(pdf_old_path, pdf_new_path)
+    if args.more:
+        print("🔍 正在按版本链比较以下PDF版本：")
+        for k, path in enumerate(pdf_paths):
+            print(f"📄 v{k + 1}：{path}")
+    else:
+        print(f"🔍 正在比较以下PDF版本：\n📄 旧版本：{pdf_old_path}\n📄 新版本：{pdf_new_path}\n")
 
-    if results.empty:
-        print("🎉 两个文档完全一致，无任何内容变更。")
-        return
+    with contextlib.ExitStack() as stack:
+        cache = stack.enter_context(DiffCache(args.cache, args.cache_size * 1024 * 1024)) if args.cache else None
+        if args.more:
+            run_chain(pdf_paths, args.output, args.workers, cache)
+            if cache is not None:
+                print(f"\n💾 缓存命中 {cache.hits} 次，未命中 {cache.misses} 次")
+            print(f"\n✅ 差异HTML报告已生成：{args.output}（可用浏览器打开查看完整对比）")
+            return
+        results = iter_page_diffs(pdf_old_path, pdf_new_path, workers=args.workers, align=args.align, cache=cache)
+        first = next(results, None)
+        if first is None:
+            print("🎉 两个文档完全一致，无任何内容变更。")
+            return
 
-    for _, row in results.iterrows():
-        print(f"📘 第 {row['Page']} 页差异：")
-        print(f"  ➕ 新增: {row['Added'][:100]}{'...' if len(row['Added']) > 100 else ''}")
-        print(f"  ➖ 删除: {row['Deleted'][:100]}{'...' if len(row['Deleted']) > 100 else ''}")
+        with HtmlReportWriter(args.output) as writer:
+            for row in itertools.chain([first], results):
+                print_row(row)
+                writer.write(row)
+        if cache is not None:
+            print(f"\n💾 缓存命中 {cache.hits} 次，未命中 {cache.misses} 次")
 
-    generate_full_html_report(results)
-    print("\n✅ 差异HTML报告已生成：diff_report.html（可用浏览器打开查看完整对比）")
+    print(f"\n✅ 差异HTML报告已生成：{args.output}（可用浏览器打开查看完整对比）")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()